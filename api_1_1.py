@@ -1,30 +1,80 @@
 import os
 import sys
+import asyncio
 import uuid
+import time
+import io
+import json
+import hashlib
+import secrets
+import shutil
+import sqlite3
+import subprocess
+import threading
+import importlib.util
+import contextlib
+import functools
+import multiprocessing
+from typing import Literal, Optional
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, CancelledError, InvalidStateError
+from concurrent.futures.process import BrokenProcessPool
 import uvicorn
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import torch
 import logging
 from pydantic import BaseModel as PydanticBaseModel
-from openai import OpenAI
 
 # 确保这些路径和包在你运行 main.py 的目录下是可访问的
 sys.path.append(sys.path[0] + r"/../") 
 # 注意：如果运行报错找不到模块，可能需要将上面的 sys.path 调整为绝对路径或根据你的目录结构调整
 from os.path import join as pjoin
-from models import *
 from collections import OrderedDict
 from configs import get_config
-from utils.plot_script import *
-from utils.preprocess import *
-from utils import paramUtil
 import lightning as L
-import scipy.ndimage.filters as filters
 import copy
 import numpy as np
 
+# models / utils.plot_script (matplotlib) / scipy / openai 都在第一次用到时才导入，
+# 渲染子进程与 /healthz 不必等模型代码加载完
+_LAZY_MODULES = ("models", "utils.preprocess", "utils.plot_script")
+
+
+def lazy_import(name):
+    """按顺序在模型相关包中查找 name（原先通过 import * 引入的名字），首次调用时才导入对应的包。"""
+    for module_name in _LAZY_MODULES:
+        module = importlib.import_module(module_name)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise ImportError(f"cannot find {name} in {', '.join(_LAZY_MODULES)}")
+
+
+# 同一个随机数生成器（每张 GPU 一个，CPU 共用一个）上指定 seed 的推理需要串行
+_RNG_LOCKS = {}
+_RNG_LOCKS_GUARD = threading.Lock()
+
+
+@contextlib.contextmanager
+def seeded_rng(device, seed):
+    """以 seed 重置 device 上的随机数生成器执行推理，结束后恢复原状态，不影响未指定 seed 的请求。
+
+    多个 CPU 副本共用一个生成器：同时有未指定 seed 的 CPU 推理时仍可能打乱噪声，需严格复现时只用一个 CPU 副本。
+    """
+    device = torch.device(device)
+    cuda = device.type == "cuda"
+    with _RNG_LOCKS_GUARD:
+        lock = _RNG_LOCKS.setdefault(str(device) if cuda else "cpu", threading.Lock())
+    with lock, torch.random.fork_rng(devices=[device] if cuda else []):
+        if cuda:
+            with torch.cuda.device(device):
+                torch.cuda.manual_seed(seed)
+        else:
+            torch.default_generator.manual_seed(seed)
+        yield
+
+
 # --- 你的类定义 (保持不变) ---
 class LitGenModel(L.LightningModule):
     def __init__(self, model, cfg):
@@ -39,9 +89,15 @@ class LitGenModel(L.LightningModule):
         os.makedirs(self.meta_dir, exist_ok=True)
         os.makedirs(self.log_dir, exist_ok=True)
         self.model = model
-        self.normalizer = MotionNormalizer()
+        self.normalizer = lazy_import("MotionNormalizer")()
+        # 推理时 autocast 的精度，None 表示保持模型原精度（见 prepare_cpu_replica）
+        self.autocast_dtype = None
+        # 后处理用到的常量张量，按设备缓存：{设备: (mean, std, 高斯核)}
+        self._postprocess_consts = {}
 
     def plot_t2m(self, mp_data, result_path, caption):
+        from utils import paramUtil
+        from utils.plot_script import plot_3d_motion
         mp_joint = []
         for i, data in enumerate(mp_data):
             if i == 0:
@@ -53,13 +109,10 @@ class LitGenModel(L.LightningModule):
         plot_3d_motion(result_path, paramUtil.t2m_kinematic_chain, mp_joint, title=caption, fps=30)
 
     def generate_one_sample(self, prompt, name):
-        self.model.eval()
-        batch = OrderedDict({})
-        batch["motion_lens"] = torch.zeros(1,1).long().cuda()
-        batch["prompt"] = prompt
-        window_size = 210
-        motion_output = self.generate_loop(batch, window_size)
-        
+        motion_output = self.generate_batch([prompt], DEFAULT_WINDOW_SIZE)[0]
+        return self.render_sample(motion_output, prompt, name) # 修改：返回生成文件的路径以便 API 使用
+
+    def render_sample(self, motion_output, prompt, name):
         # 确保输出目录存在
         output_dir = "results"
         if not os.path.exists(output_dir):
@@ -69,66 +122,1624 @@ class LitGenModel(L.LightningModule):
 
         self.plot_t2m([motion_output[0], motion_output[1]],
                       result_path,
-                      batch["prompt"])
-        return result_path # 修改：返回生成文件的路径以便 API 使用
+                      prompt)
+        return result_path
 
     def generate_loop(self, batch, window_size):
-        prompt = batch["prompt"]
-        batch = copy.deepcopy(batch)
-        batch["motion_lens"][:] = window_size
-        sequences = [[], []]
-        batch["text"] = [prompt]
-        batch = self.model.forward_test(batch)
-        motion_output_both = batch["output"][0].reshape(batch["output"][0].shape[0], 2, -1)
-        motion_output_both = self.normalizer.backward(motion_output_both.cpu().detach().numpy())
-        for j in range(2):
-            motion_output = motion_output_both[:,j]
-            joints3d = motion_output[:,:22*3].reshape(-1,22,3)
-            joints3d = filters.gaussian_filter1d(joints3d, 1, axis=0, mode='nearest')
-            sequences[j].append(joints3d)
-        sequences[0] = np.concatenate(sequences[0], axis=0)
-        sequences[1] = np.concatenate(sequences[1], axis=0)
-        return sequences
+        return self.generate_batch([batch["prompt"]], window_size, seed=batch.get("seed"))[0]
+
+    def generate_batch(self, prompts, window_size, progress=None, seed=None, sampling_strategy=None):
+        """一次 forward_test 推理多个 prompt，返回每个 prompt 的 [person0, person1] 关节序列。
+
+        window_size 为生成帧数，推理耗时与之近似成正比。
+        progress(event, **data): 可选的进度回调，上报 diffusion_step (step/total) 与 postprocessed。
+        seed: 非空时固定扩散的初始噪声，同一 seed 下单个 prompt 的结果可复现。
+        sampling_strategy: 本次推理使用的采样策略（如预览用的 "ddim10"），为空时使用配置中的策略。
+        """
+        self.model.eval()
+        batch = OrderedDict({})
+        # 使用模型所在设备，而不是写死 .cuda()，方便用 CPU stub 模型做压测
+        batch["motion_lens"] = torch.full((len(prompts), 1), window_size, dtype=torch.long, device=self.device)
+        batch["text"] = list(prompts)
+        if self.autocast_dtype is not None:
+            autocast = torch.autocast(self.device.type, dtype=self.autocast_dtype)
+        else:
+            autocast = contextlib.nullcontext()
+        device = str(self.device)
+        rng = seeded_rng(self.device, seed) if seed is not None else contextlib.nullcontext()
+        with self.use_sampling_strategy(sampling_strategy):
+            # 步数取自当前的采样策略，需在替换之后注册
+            hook = self._register_step_hook(progress) if progress else None
+            try:
+                with rng, torch.inference_mode(), autocast, INFERENCE_SECONDS.time(device=device):
+                    batch = self.model.forward_test(batch)
+            finally:
+                if hook is not None:
+                    hook.remove()
+        with torch.inference_mode(), POSTPROCESS_SECONDS.time(device=device):
+            joints = self.postprocess_batch(batch["output"])
+        # 每个结果是同一块预分配数组上的视图
+        results = [[joints[i, 0], joints[i, 1]] for i in range(len(prompts))]
+        if progress:
+            progress("postprocessed")
+        return results
+
+    def postprocess_batch(self, output, sigma=1.0, truncate=4.0):
+        """把 forward_test 输出的 (B, T, 2*D) 一次性转换为 (B, 2, T, 22, 3) 的 float32 关节数组。
+
+        反归一化、截取 22x3 关节与时间维高斯平滑（与 gaussian_filter1d(sigma=1, mode='nearest') 等价）
+        都在模型所在设备上对整个 batch 完成，最后一次拷贝到预分配的 numpy 数组。
+        """
+        B, T = output.shape[:2]
+        x = output.reshape(B, T, 2, -1)
+        mean, std, kernel = self._get_postprocess_consts(x.device, sigma, truncate)
+        if mean is not None:
+            # 只有前 22x3 维是关节位置，只对这部分反归一化
+            joints = x[..., :22 * 3].float() * std[:22 * 3] + mean[:22 * 3]
+        else:
+            # normalizer 未暴露均值 / 方差时退回其 numpy 实现
+            x = self.normalizer.backward(x.float().cpu().numpy())
+            joints = torch.from_numpy(np.ascontiguousarray(x[..., :22 * 3], dtype=np.float32)).to(output.device)
+        # 沿时间维复制边界后做加权平移求和，核只有 2*radius+1 个系数，比逐通道卷积更省
+        radius = kernel.shape[0] // 2
+        padded = torch.cat([joints[:, :1].expand(B, radius, 2, 22 * 3), joints,
+                            joints[:, -1:].expand(B, radius, 2, 22 * 3)], dim=1)
+        smoothed = padded[:, :T] * kernel[0]
+        for k in range(1, kernel.shape[0]):
+            smoothed.add_(padded[:, k:k + T], alpha=float(kernel[k]))
+        result = np.empty((B, 2, T, 22, 3), dtype=np.float32)
+        # (B, T, 2, 66) -> (B, 2, T, 22, 3)，一次拷贝到主机
+        torch.from_numpy(result).copy_(smoothed.reshape(B, T, 2, 22, 3).transpose(1, 2))
+        return result
+
+    def _get_postprocess_consts(self, device, sigma, truncate):
+        key = (str(device), sigma, truncate)
+        if key not in self._postprocess_consts:
+            mean = getattr(self.normalizer, "motion_mean", None)
+            std = getattr(self.normalizer, "motion_std", None)
+            if mean is not None and std is not None:
+                mean = torch.as_tensor(np.asarray(mean), dtype=torch.float32, device=device)
+                std = torch.as_tensor(np.asarray(std), dtype=torch.float32, device=device)
+            else:
+                mean = std = None
+            radius = int(truncate * sigma + 0.5)
+            offsets = torch.arange(-radius, radius + 1, dtype=torch.float32, device=device)
+            kernel = torch.exp(-0.5 * (offsets / sigma) ** 2)
+            kernel = (kernel / kernel.sum()).cpu()
+            self._postprocess_consts[key] = (mean, std, kernel)
+        return self._postprocess_consts[key]
+
+    @contextlib.contextmanager
+    def use_sampling_strategy(self, strategy):
+        """临时替换解码器的 sampling_strategy，forward_test 每次调用时按它重建采样步。
+
+        每个副本只由自己的 batcher 线程推理，替换不会影响同时进行的其它 batch。
+        """
+        decoder = getattr(self.model, "decoder", None)
+        if strategy is None or not hasattr(decoder, "sampling_strategy"):
+            yield
+            return
+        previous = decoder.sampling_strategy
+        decoder.sampling_strategy = strategy
+        try:
+            yield
+        finally:
+            decoder.sampling_strategy = previous
+
+    def _register_step_hook(self, progress):
+        """在去噪网络上挂 forward hook：每调用一次即完成一个扩散步。"""
+        decoder = getattr(self.model, "decoder", None)
+        net = getattr(decoder, "net", None)
+        if not isinstance(net, torch.nn.Module):
+            return None
+        # sampling_strategy 形如 "ddim50"，取其中的步数
+        digits = "".join(c for c in str(getattr(decoder, "sampling_strategy", "")) if c.isdigit())
+        total = int(digits) if digits else getattr(decoder, "diffusion_steps", None)
+        step = [0]
+
+        def _hook(module, inputs, output):
+            step[0] += 1
+            progress("diffusion_step", step=step[0], total=total)
+
+        return net.register_forward_hook(_hook)
+
+def render_motion_file(mp_data, result_path, caption):
+    """在渲染进程中把两人的关节序列画成 MP4。
+
+    必须是模块级函数，才能被 ProcessPoolExecutor pickle 到子进程执行。
+    """
+    from utils import paramUtil
+    from utils.plot_script import plot_3d_motion
+    mp_joint = [data[:,:22*3].reshape(-1,22,3) for data in mp_data]
+    os.makedirs(os.path.dirname(result_path) or ".", exist_ok=True)
+    plot_3d_motion(result_path, paramUtil.t2m_kinematic_chain, mp_joint, title=caption, fps=30)
+    return result_path
+
+
+# ---------------- 原生渲染 ----------------
+# 不经过 matplotlib：NumPy 批量投影骨架、直接在 uint8 帧缓冲中画线，原始帧通过管道交给 ffmpeg 编码
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+NATIVE_RENDER_SIZE = int(os.getenv("NATIVE_RENDER_SIZE", "512"))
+NATIVE_RENDER_CHUNK = 32
+# 预览视频：分辨率与抽帧间隔（30 fps / PREVIEW_FRAME_STEP）
+PREVIEW_RENDER_SIZE = int(os.getenv("PREVIEW_RENDER_SIZE", "256"))
+PREVIEW_FRAME_STEP = max(1, int(os.getenv("PREVIEW_FRAME_STEP", "2")))
+# 流式输出时两个关键帧之间的最大帧数：每个关键帧开始一个 MP4 分片，越小首帧越早到达、码率越高
+STREAM_GOP_FRAMES = int(os.getenv("STREAM_GOP_FRAMES", "15"))
+# 与 plot_3d_motion 的配色一致：第一个人红色、第二个人绿色
+_PERSON_COLORS = np.array([(255, 0, 0), (0, 128, 0), (0, 0, 0)], dtype=np.uint8)
+_BACKGROUND_COLOR = np.array((255, 255, 255), dtype=np.uint8)
+# plot_xzPlane 画的是 alpha=0.5 的灰色地面，叠在白底上即为浅灰
+_FLOOR_COLOR = np.array((191, 191, 191), dtype=np.uint8)
+
+
+class _SkeletonCamera:
+    """固定在场景前上方的透视相机，与 plot_3d_motion 的视角近似（俯视约 30°，人物直立）。"""
+
+    def __init__(self, joints, size, elev=30.0):
+        # joints: (P, T, 22, 3)，y 轴朝上
+        self.size = size
+        root = joints[:, :, 0]
+        self.center = np.array([root[..., 0].mean(), 0.0, root[..., 2].mean()], dtype=np.float32)
+        height = float(joints[..., 1].max())
+        self.extent = max(float(np.abs(joints[..., 0] - self.center[0]).max()),
+                          float(np.abs(joints[..., 2] - self.center[2]).max()), height, 1.0)
+        target = self.center + np.array([0.0, height / 2, 0.0], dtype=np.float32)
+        e = np.radians(elev)
+        distance = 4.0 * self.extent
+        self.eye = target + distance * np.array([0.0, np.sin(e), np.cos(e)], dtype=np.float32)
+        forward = (target - self.eye) / np.linalg.norm(target - self.eye)
+        right = np.cross(forward, np.array([0.0, 1.0, 0.0], dtype=np.float32))
+        right /= np.linalg.norm(right)
+        self.axes = np.stack([right, np.cross(right, forward), forward]).astype(np.float32)
+        self.focal = (size / 2) * distance / (1.4 * self.extent)
+
+    def project(self, points):
+        """(..., 3) 世界坐标 -> (..., 2) 像素坐标，一次处理任意多帧。"""
+        cam = (points - self.eye) @ self.axes.T
+        depth = np.maximum(cam[..., 2], 1e-6)
+        half = self.size / 2
+        return np.stack([half + self.focal * cam[..., 0] / depth,
+                         half - self.focal * cam[..., 1] / depth], axis=-1)
+
+    def background(self):
+        """白底加上投影后的地面四边形（凸多边形，逐像素半平面测试）。"""
+        frame = np.empty((self.size, self.size, 3), dtype=np.uint8)
+        frame[:] = _BACKGROUND_COLOR
+        r = 1.2 * self.extent
+        corners = self.center + np.array([[-r, 0, -r], [r, 0, -r], [r, 0, r], [-r, 0, r]], dtype=np.float32)
+        poly = self.project(corners)
+        ys, xs = np.mgrid[0:self.size, 0:self.size].astype(np.float32) + 0.5
+        signs = []
+        for (x0, y0), (x1, y1) in zip(poly, np.roll(poly, -1, axis=0)):
+            signs.append((x1 - x0) * (ys - y0) - (y1 - y0) * (xs - x0))
+        inside = np.all([sign >= 0 for sign in signs], axis=0) | np.all([sign <= 0 for sign in signs], axis=0)
+        frame[inside] = _FLOOR_COLOR
+        return frame
+
+
+def _draw_segments(frames, starts, ends, colors, thickness=3):
+    """在 frames (F, H, W, 3) 上一次性画出所有帧的所有线段。
+
+    starts / ends: (F, S, 2) 像素坐标；colors: (S, 3)。沿线段等距采样，再按笔刷偏移加粗。
+    """
+    F, H, W, _ = frames.shape
+    S = starts.shape[1]
+    steps = int(np.ceil(np.abs(ends - starts).max())) + 1 if starts.size else 1
+    t = np.linspace(0.0, 1.0, steps, dtype=np.float32)
+    points = np.rint(starts[:, :, None] + (ends - starts)[:, :, None] * t[None, None, :, None]).astype(np.int32)
+    r = thickness // 2
+    brush = np.array([(dx, dy) for dy in range(-r, r + 1) for dx in range(-r, r + 1)
+                      if dx * dx + dy * dy <= r * r + r], dtype=np.int32)
+    x = points[..., 0, None] + brush[:, 0]
+    y = points[..., 1, None] + brush[:, 1]
+    valid = (x >= 0) & (x < W) & (y >= 0) & (y < H)
+    frame_idx = np.broadcast_to(np.arange(F, dtype=np.int64)[:, None, None, None], x.shape)[valid]
+    segment_idx = np.broadcast_to(np.arange(S)[None, :, None, None], x.shape)[valid]
+    flat = frames.reshape(-1, 3)
+    flat[(frame_idx * H + y[valid]) * W + x[valid]] = colors[segment_idx]
+
+
+def render_motion_native(mp_data, result_path, caption, fps=30, size=NATIVE_RENDER_SIZE, fragmented=False,
+                         frame_step=1):
+    """render_motion_file 的快速版本：输出同样视角、配色与地面的 MP4，但不绘制标题文字
+    （caption 写入视频元数据）。需要 ffmpeg 可执行文件（FFMPEG_BIN）。
+
+    frame_step 大于 1 时每隔 frame_step 帧取一帧，fps 应相应降低以保持时长。
+
+    fragmented 为 True 时输出分片 MP4（moov 在文件开头，之后每 STREAM_GOP_FRAMES 帧一个分片），
+    文件边编码边增长，读到的任意前缀都可以直接播放。
+    """
+    from utils import paramUtil
+    mp_joint = [np.asarray(data)[:, :22 * 3].reshape(-1, 22, 3) for data in mp_data]
+    frame_count = min(len(j) for j in mp_joint)
+    joints = np.stack([j[:frame_count:frame_step] for j in mp_joint]).astype(np.float32)
+    frame_count = joints.shape[1]
+    # 与 plot_3d_motion 一致：每个人各自把最低点放到地面上
+    joints[..., 1] -= joints[..., 1].min(axis=(1, 2), keepdims=True)
+
+    bones = np.array([(a, b) for chain in paramUtil.t2m_kinematic_chain
+                      for a, b in zip(chain[:-1], chain[1:])])
+    persons = len(joints)
+    colors = np.repeat(_PERSON_COLORS[:persons], len(bones), axis=0)
+    camera = _SkeletonCamera(joints, size)
+    pixels = camera.project(joints)  # (P, T, 22, 2)
+    # (P, T, B, 2) -> (T, P*B, 2)
+    starts = pixels[:, :, bones[:, 0]].transpose(1, 0, 2, 3).reshape(frame_count, -1, 2)
+    ends = pixels[:, :, bones[:, 1]].transpose(1, 0, 2, 3).reshape(frame_count, -1, 2)
+    background = camera.background()
+
+    os.makedirs(os.path.dirname(result_path) or ".", exist_ok=True)
+    if fragmented:
+        container = ["-g", str(STREAM_GOP_FRAMES), "-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+    else:
+        container = ["-movflags", "+faststart"]
+    cmd = [FFMPEG_BIN, "-y", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size}x{size}", "-r", str(fps), "-i", "-",
+           "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", *container,
+           "-metadata", f"title={caption}", result_path]
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise RuntimeError(f"ffmpeg not found ({FFMPEG_BIN}), set FFMPEG_BIN or use the matplotlib renderer")
+    buffer = np.empty((NATIVE_RENDER_CHUNK, size, size, 3), dtype=np.uint8)
+    try:
+        for start in range(0, frame_count, NATIVE_RENDER_CHUNK):
+            end = min(start + NATIVE_RENDER_CHUNK, frame_count)
+            frames = buffer[:end - start]
+            frames[:] = background
+            _draw_segments(frames, starts[start:end], ends[start:end], colors)
+            proc.stdin.write(frames.data)
+            if fragmented:
+                proc.stdin.flush()
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass  # ffmpeg 提前退出，下面报告它的错误输出
+    except BaseException:
+        proc.kill()
+        raise
+    stderr = proc.stderr.read()
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr.decode('utf-8', 'replace')[-500:]}")
+    return result_path
+
+
+# 渲染器名称 -> 渲染函数（在渲染进程中执行）
+RENDERERS = {
+    "matplotlib": render_motion_file,
+    "native": render_motion_native,
+    # 流式输出专用：边编码边写出分片 MP4
+    "native-stream": functools.partial(render_motion_native, fragmented=True),
+    # 预览专用：低分辨率、低帧率
+    "native-preview": functools.partial(render_motion_native, fps=30 // PREVIEW_FRAME_STEP,
+                                        size=PREVIEW_RENDER_SIZE, frame_step=PREVIEW_FRAME_STEP),
+}
+DEFAULT_RENDERER = "matplotlib"
+STREAM_RENDERER = "native-stream"
+PREVIEW_RENDERER = "native-preview"
+# 流式读取正在编码的视频时，没有新数据后的轮询间隔（秒）
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "0.05"))
+
+# 输出格式 -> (media_type, 文件扩展名)
+OUTPUT_FORMATS = {
+    "mp4": ("video/mp4", "mp4"),
+    "npz": ("application/octet-stream", "npz"),
+    "npy-stream": ("application/octet-stream", "npy"),
+    "json": ("application/json", "json"),
+}
+
+def encode_joints(motion_output, fmt, dtype="float32"):
+    """把两人的 (T, 22, 3) 关节序列直接编码为字节，不经过视频渲染。
+
+    - npz: person0 / person1 两个数组
+    - npy-stream: 单个 (2, T, 22, 3) 的 .npy，头部之后即为连续的原始数据
+    - json: {"shape": [...], "persons": [...]}
+    """
+    joints = np.stack([motion_output[0], motion_output[1]]).astype(dtype)
+    buf = io.BytesIO()
+    if fmt == "npz":
+        np.savez_compressed(buf, person0=joints[0], person1=joints[1])
+    elif fmt == "npy-stream":
+        np.save(buf, joints)
+    elif fmt == "json":
+        buf.write(json.dumps({"shape": list(joints.shape), "persons": joints.tolist()}).encode("utf-8"))
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    return buf.getvalue()
 
 def build_models(cfg):
     if cfg.NAME == "InterGen":
-        model = InterGen(cfg)
+        model = lazy_import("InterGen")(cfg)
     return model
 
 # --- FastAPI 封装部分 ---
 
+# ---------------- 监控指标 ----------------
+# 手写的 Prometheus 文本格式指标，由 /metrics 导出；不引入 prometheus_client 依赖
+# 耗时直方图的分桶上界（秒），覆盖从毫秒级的后处理到分钟级的渲染
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器，按标签组合分别计数。"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """累积分桶直方图，导出 _bucket / _sum / _count。"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+QUEUE_WAIT_SECONDS = metrics.register(Histogram(
+    "motion_queue_wait_seconds", "Time a prompt waits in the inference queue before its batch starts.", ["replica"]))
+BATCH_SIZE = metrics.register(Histogram(
+    "motion_batch_size", "Number of prompts per forward_test batch.", ["replica"],
+    buckets=(1, 2, 4, 8, 16, 32)))
+INFERENCE_SECONDS = metrics.register(Histogram(
+    "motion_inference_seconds", "forward_test duration per batch.", ["device"]))
+POSTPROCESS_SECONDS = metrics.register(Histogram(
+    "motion_postprocess_seconds", "Joint post-processing duration per batch.", ["device"]))
+TRANSLATION_SECONDS = metrics.register(Histogram(
+    "motion_translation_seconds", "Remote translation call duration (cache misses only)."))
+RENDER_SECONDS = metrics.register(Histogram(
+    "motion_render_seconds", "Video render duration, including time queued for a render worker."))
+TRANSFER_SECONDS = metrics.register(Histogram(
+    "motion_response_transfer_seconds",
+    "Time from the first to the last byte of a result body (video or joints), by route. "
+    "Streamed videos include the time spent waiting for the encoder.", ["route"]))
+JOB_STAGE_SECONDS = metrics.register(Histogram(
+    "motion_job_stage_seconds", "Time jobs spend in each pipeline stage.", ["stage"]))
+ERRORS = metrics.register(Counter(
+    "motion_errors_total", "Failures by pipeline stage.", ["stage"]))
+HTTP_REQUESTS = metrics.register(Counter(
+    "motion_http_requests_total", "HTTP requests by route and status code.", ["method", "route", "status"]))
+
+
+# ---------------- 动态批处理 ----------------
+# 可通过环境变量调整批大小与等待窗口
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+
+
+def _notify(callback, event, **data):
+    """调用进度回调，回调异常不影响推理。"""
+    if callback is None:
+        return
+    try:
+        callback(event, **data)
+    except Exception:
+        logging.exception("Progress callback failed")
+
+
+class InferenceCancelled(Exception):
+    """batch 中所有请求都已取消，在扩散步之间中止 forward_test。"""
+
+
+class _PendingItem:
+    __slots__ = ("prompt", "window_size", "seed", "sampling_strategy", "future", "enqueued_at",
+                 "on_start", "on_event", "should_cancel")
+
+    def __init__(self, prompt, window_size, seed=None, sampling_strategy=None, on_start=None, on_event=None,
+                 should_cancel=None):
+        self.prompt = prompt
+        self.window_size = window_size
+        self.seed = seed
+        self.sampling_strategy = sampling_strategy
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.on_start = on_start
+        self.on_event = on_event
+        self.should_cancel = should_cancel
+
+
+class MotionBatcher:
+    """把并发到达的 prompt 在一个时间窗口内合并，执行一次批量 forward_test。
+
+    infer_fn(prompts, window_size, progress=None, seed=None, sampling_strategy=None) 需要返回与 prompts 等长的结果列表，
+    可以是 LitGenModel.generate_batch，也可以是压测用的 CPU stub。
+    progress 回调的事件会转发给该 batch 中每个请求的 on_event。
+    """
+
+    def __init__(self, infer_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, name="motion-batcher"):
+        self.infer_fn = infer_fn
+        self.name = name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        # 运行指标：正在推理的请求数、累计 batch 数 / 样本数 / 忙碌时长
+        self._in_flight = 0
+        self._batches = 0
+        self._samples = 0
+        self._busy_seconds = 0.0
+        self._busy_since = None
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, window_size=210, seed=None, sampling_strategy=None, on_start=None, on_event=None,
+               should_cancel=None):
+        """提交一个 prompt，返回 Future，结果为 [person0, person1] 关节序列。
+
+        window_size、seed 与 sampling_strategy 都相同的请求才会合并到一个 batch。
+        on_start: 可选回调，在该 prompt 所在的 batch 开始推理时调用。
+        on_event(event, **data): 可选回调，接收排队位置 (queue_position) 与推理进度事件。
+        should_cancel(): 可选回调，batch 中所有请求都返回 True 时在扩散步之间中止推理。
+        排队中的请求直接 future.cancel() 即可出队。
+        """
+        item = _PendingItem(prompt, window_size, seed, sampling_strategy, on_start, on_event, should_cancel)
+        with self._cond:
+            self._queue.append(item)
+            position = len(self._queue) - 1
+            self._cond.notify()
+        _notify(on_event, "queue_position", position=position)
+        return item.future
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def load(self):
+        """排队中与推理中的请求总数，用于在多个副本间选择最空闲的一个。"""
+        with self._cond:
+            return len(self._queue) + self._in_flight
+
+    def stats(self):
+        with self._cond:
+            now = time.perf_counter()
+            busy = self._busy_seconds
+            if self._busy_since is not None:
+                busy += now - self._busy_since
+            return {
+                "name": self.name,
+                "queue_depth": len(self._queue),
+                "in_flight": self._in_flight,
+                "batches": self._batches,
+                "samples": self._samples,
+                "utilization": round(busy / max(now - self._started_at, 1e-6), 4),
+            }
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # 从最早的请求开始计时，窗口内尽量凑满一个 batch
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            # 同一个 batch 只能使用同一个 window_size、seed 与采样策略。指定 seed 的请求单独推理：
+            # 同批的其它样本会改变它分到的初始噪声，结果就无法复现
+            head = self._queue[0]
+            bucket = (head.window_size, head.seed, head.sampling_strategy)
+            limit = self.max_batch_size if head.seed is None else 1
+            items, rest = [], deque()
+            while self._queue:
+                item = self._queue.popleft()
+                if (item.window_size, item.seed, item.sampling_strategy) == bucket and len(items) < limit:
+                    items.append(item)
+                else:
+                    rest.append(item)
+            self._queue = rest
+            waiting = list(self._queue)
+        # 通知仍在排队的请求新的排队位置
+        for position, item in enumerate(waiting):
+            _notify(item.on_event, "queue_position", position=position)
+        return items, bucket
+
+    def _loop(self):
+        while True:
+            items, (window_size, seed, sampling_strategy) = self._take_batch()
+            items = [item for item in items if item.future.set_running_or_notify_cancel()]
+            if not items:
+                continue
+            for item in items:
+                if item.on_start:
+                    try:
+                        item.on_start()
+                    except Exception:
+                        logging.exception("Batch on_start callback failed")
+            listeners = [item.on_event for item in items if item.on_event]
+            cancellable = all(item.should_cancel for item in items)
+            with self._cond:
+                self._in_flight = len(items)
+                self._busy_since = time.perf_counter()
+            for item in items:
+                QUEUE_WAIT_SECONDS.observe(self._busy_since - item.enqueued_at, replica=self.name)
+            BATCH_SIZE.observe(len(items), replica=self.name)
+
+            def progress(event, **data):
+                if cancellable and all(item.should_cancel() for item in items):
+                    raise InferenceCancelled()
+                for listener in listeners:
+                    _notify(listener, event, **data)
+
+            try:
+                outputs = self.infer_fn([item.prompt for item in items], window_size,
+                                        progress=progress if listeners or cancellable else None, seed=seed,
+                                        sampling_strategy=sampling_strategy)
+            except InferenceCancelled:
+                self._finish_batch(items)
+                print(f"Batch of {len(items)} cancelled during inference")
+                for item in items:
+                    item.future.set_exception(CancelledError())
+                continue
+            except Exception as e:
+                logging.exception("Batched inference failed")
+                ERRORS.inc(stage="inference")
+                self._finish_batch(items)
+                for item in items:
+                    item.future.set_exception(e)
+                continue
+            self._finish_batch(items)
+            for item, output in zip(items, outputs):
+                item.future.set_result(output)
+
+    def _finish_batch(self, items):
+        with self._cond:
+            self._in_flight = 0
+            self._batches += 1
+            self._samples += len(items)
+            self._busy_seconds += time.perf_counter() - self._busy_since
+            self._busy_since = None
+
+
+# ---------------- 多副本调度 ----------------
+# 模型副本所在设备，逗号分隔，如 "cuda:0,cuda:1" 或 "cpu,cpu"；同一设备可重复出现以放多个副本。
+# 为空时使用全部可见 GPU，没有 GPU 时使用一个 CPU 副本。
+MODEL_DEVICES = os.getenv("MODEL_DEVICES", "")
+
+
+def resolve_devices(spec=MODEL_DEVICES):
+    devices = [d.strip() for d in spec.split(",") if d.strip()]
+    if devices:
+        return [torch.device(d) for d in devices]
+    if torch.cuda.is_available():
+        return [torch.device(f"cuda:{i}") for i in range(torch.cuda.device_count())]
+    return [torch.device("cpu")]
+
+
+# ---------------- CPU 推理 ----------------
+# 算子内 / 算子间线程数，0 表示使用 PyTorch 默认值（物理核数）
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))
+CPU_INTEROP_THREADS = int(os.getenv("CPU_INTEROP_THREADS", "0"))
+# CPU 副本的推理精度：fp32 / bf16（autocast）/ int8（Linear 层动态量化）
+CPU_PRECISION = os.getenv("CPU_PRECISION", "fp32").lower()
+
+
+def configure_cpu_runtime():
+    """按环境变量设置 PyTorch CPU 线程数，需在第一次推理前调用。"""
+    if CPU_THREADS > 0:
+        torch.set_num_threads(CPU_THREADS)
+    if CPU_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(CPU_INTEROP_THREADS)
+        except RuntimeError as e:
+            # 算子间线程池一旦启动就不能再修改
+            print(f"Warning: cannot set inter-op threads: {e}")
+    print(f"CPU threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+
+def prepare_cpu_replica(litmodel, precision=CPU_PRECISION):
+    """按 precision 处理 CPU 上的模型副本：int8 动态量化 Linear 层，bf16 推理时 autocast。"""
+    if precision == "int8":
+        litmodel.model = torch.ao.quantization.quantize_dynamic(
+            litmodel.model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision == "bf16":
+        litmodel.autocast_dtype = torch.bfloat16
+    elif precision != "fp32":
+        raise ValueError(f"Unsupported CPU_PRECISION: {precision}")
+    return litmodel
+
+
+class ReplicaPool:
+    """每个模型副本各有一个 MotionBatcher，新请求交给当前负载（排队 + 推理中）最小的副本。
+
+    对外提供与 MotionBatcher 相同的 submit / queue_depth 接口。
+    """
+
+    def __init__(self, replicas, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        # replicas: [(设备名, infer_fn), ...]
+        self.devices = []
+        self.batchers = []
+        for i, (device, infer_fn) in enumerate(replicas):
+            self.devices.append(str(device))
+            self.batchers.append(MotionBatcher(infer_fn, max_batch_size, max_wait_ms,
+                                               name=f"motion-batcher-{i}"))
+        self._lock = threading.Lock()
+
+    def submit(self, prompt, window_size=210, seed=None, sampling_strategy=None, on_start=None, on_event=None,
+               should_cancel=None):
+        # 选择与入队放在同一把锁内，避免并发请求都挤到同一个副本
+        with self._lock:
+            target = min(self.batchers, key=lambda b: b.load())
+            return target.submit(prompt, window_size, seed, sampling_strategy, on_start=on_start,
+                                 on_event=on_event, should_cancel=should_cancel)
+
+    def queue_depth(self):
+        return sum(b.queue_depth() for b in self.batchers)
+
+    def stats(self):
+        replicas = []
+        for i, (device, b) in enumerate(zip(self.devices, self.batchers)):
+            replicas.append({"replica": i, "device": device, **b.stats()})
+        return {"queue_depth": sum(r["queue_depth"] for r in replicas), "replicas": replicas}
+
+
+# ---------------- 渲染进程池 ----------------
+# 渲染进程数：matplotlib 编码是 CPU 密集型，放到独立进程中与 GPU 推理并行
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+
+
+class RenderPool:
+    """视频渲染阶段：推理线程只负责提交关节序列，编码在进程池中完成。"""
+
+    def __init__(self, max_workers=RENDER_WORKERS, output_dir="results"):
+        self.max_workers = max(1, int(max_workers))
+        self.output_dir = output_dir
+        self._executor = self._new_executor()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _new_executor(self):
+        # 使用 spawn，避免 fork 已初始化 CUDA 的父进程
+        return ProcessPoolExecutor(max_workers=self.max_workers,
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_broken(self, broken):
+        """渲染子进程异常退出（如被 OOM 杀掉）后整个进程池不可再用，换一个新的进程池。"""
+        with self._lock:
+            if self._executor is not broken:
+                # 其它线程已经替换过
+                return
+            logging.error("Render pool is broken, starting a new one")
+            self._executor = self._new_executor()
+        broken.shutdown(wait=False)
+
+    def submit(self, motion_output, caption, name, renderer=DEFAULT_RENDERER):
+        """提交渲染任务，返回 Future，结果为生成的 MP4 路径。renderer 为 RENDERERS 中的名称。"""
+        result_path = f"{self.output_dir}/{name}.mp4"
+        args = (RENDERERS[renderer], [motion_output[0], motion_output[1]], result_path, caption)
+        executor = self._executor
+        try:
+            future = executor.submit(*args)
+        except BrokenProcessPool:
+            self._replace_broken(executor)
+            executor = self._executor
+            future = executor.submit(*args)
+        with self._lock:
+            self._in_flight += 1
+        submitted_at = time.perf_counter()
+        future.add_done_callback(lambda f: self._on_done(f, executor, submitted_at))
+        return future
+
+    def _on_done(self, future, executor, submitted_at):
+        with self._lock:
+            self._in_flight -= 1
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            ERRORS.inc(stage="render")
+            if isinstance(error, BrokenProcessPool):
+                self._replace_broken(executor)
+        else:
+            RENDER_SECONDS.observe(time.perf_counter() - submitted_at)
+
+    def warm_up(self):
+        """提前拉起全部渲染进程，避免第一个请求承担子进程启动开销。"""
+        for future in [self._executor.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "workers": self.max_workers,
+            "in_flight": in_flight,
+            "queue_depth": max(0, in_flight - self.max_workers),
+        }
+
+
+# ---------------- 结果缓存 ----------------
+# 缓存目录与容量上限（字节），设为 0 可关闭缓存
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "cache")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# 默认生成帧数（30 fps 下 7 秒）
+DEFAULT_WINDOW_SIZE = 210
+# 请求可指定的帧数范围；推理耗时与帧数近似成正比，短片段预览更省算力
+MIN_WINDOW_SIZE = int(os.getenv("MIN_WINDOW_SIZE", "16"))
+MAX_WINDOW_SIZE = int(os.getenv("MAX_WINDOW_SIZE", "300"))
+
+
+def normalize_prompt(text):
+    """缓存键使用的 prompt 归一化：去首尾空白、合并空白、转小写。"""
+    return " ".join(text.strip().lower().split())
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """按内容寻址的结果缓存：关节数组 (.npz) 与渲染视频 (.mp4) 存在磁盘上，按总字节数 LRU 淘汰。
+
+    键由 (归一化 prompt, window_size, seed, 模型权重哈希[, 采样策略]) 计算得到，权重变化后旧结果自然失效。
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, model_hash=""):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_hash = model_hash
+        self.hits = {"joints": 0, "video": 0}
+        self.misses = {"joints": 0, "video": 0}
+        self._entries = OrderedDict()  # 文件名 -> 字节数，按最近使用排序
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        if not self.enabled:
+            # 关闭缓存时不扫描也不淘汰，磁盘上已有的缓存原样保留
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 按修改时间恢复上次运行留下的条目（命中时会 touch 文件）
+        existing = [e for e in os.scandir(self.cache_dir)
+                    if e.is_file() and e.name.endswith((".npz", ".mp4"))]
+        for entry in sorted(existing, key=lambda e: e.stat().st_mtime):
+            self._entries[entry.name] = entry.stat().st_size
+            self._total_bytes += entry.stat().st_size
+        self._evict()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, text, window_size, seed=None, sampling_strategy=None):
+        parts = [normalize_prompt(text), window_size, seed, self.model_hash]
+        if sampling_strategy is not None:
+            # 只有预览等非默认采样才加入键中，默认采样的已有缓存保持有效
+            parts.append(sampling_strategy)
+        raw = json.dumps(parts)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_joints(self, key):
+        path = self._lookup(f"{key}.npz", "joints")
+        if not path:
+            return None
+        with np.load(path) as data:
+            return [data["person0"], data["person1"]]
+
+    def put_joints(self, key, motion_output):
+        if not self.enabled:
+            return
+        name = f"{key}.npz"
+        tmp_path = os.path.join(self.cache_dir, f"{name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, person0=motion_output[0], person1=motion_output[1])
+        os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        self._add(name)
+
+    def get_video(self, key, renderer=DEFAULT_RENDERER):
+        """命中时返回缓存中的 MP4 路径。"""
+        return self._lookup(self._video_name(key, renderer), "video")
+
+    def put_video(self, key, src_path, renderer=DEFAULT_RENDERER):
+        """把渲染好的视频移入缓存，返回之后应使用的路径（缓存关闭时原样返回）。"""
+        if not self.enabled:
+            return src_path
+        name = self._video_name(key, renderer)
+        path = os.path.join(self.cache_dir, name)
+        shutil.move(src_path, path)
+        self._add(name)
+        return path
+
+    @staticmethod
+    def _video_name(key, renderer):
+        # 同一份关节数据，不同渲染器的视频分开缓存
+        return f"{key}.mp4" if renderer == DEFAULT_RENDERER else f"{key}.{renderer}.mp4"
+
+    def owns(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.cache_dir)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+
+    def _lookup(self, name, kind):
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name in self._entries and os.path.exists(path):
+                self._entries.move_to_end(name)
+                self.hits[kind] += 1
+                hit = True
+            else:
+                self.misses[kind] += 1
+                hit = False
+        if not hit:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def _add(self, name):
+        size = os.path.getsize(os.path.join(self.cache_dir, name))
+        with self._lock:
+            self._total_bytes -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            victims = []
+            while self._total_bytes > self.max_bytes and self._entries:
+                name, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                victims.append(name)
+        for name in victims:
+            remove_file(os.path.join(self.cache_dir, name))
+
+
+class _SharedInference:
+    """同一缓存键上正在进行的一次推理，期间到达的重复请求共享它的结果。
+
+    每个请求拿到自己的 Future：取消只影响该请求，所有请求都取消后才从 batcher 中撤回推理。
+    """
+
+    def __init__(self):
+        self.future = None
+        self.started = False
+        self._subscribers = []  # [(Future, on_start, on_event, should_cancel)]
+        self._lock = threading.Lock()
+
+    def subscribe(self, on_start=None, on_event=None, should_cancel=None):
+        future = Future()
+        with self._lock:
+            self._subscribers.append((future, on_start, on_event, should_cancel))
+            started = self.started
+        if started:
+            _notify_start(on_start)
+        future.add_done_callback(self._on_subscriber_done)
+        return future
+
+    def on_start(self):
+        with self._lock:
+            self.started = True
+            callbacks = [on_start for _, on_start, _, _ in self._subscribers]
+        for on_start in callbacks:
+            _notify_start(on_start)
+
+    def on_event(self, event, **data):
+        with self._lock:
+            listeners = [on_event for _, _, on_event, _ in self._subscribers]
+        for on_event in listeners:
+            _notify(on_event, event, **data)
+
+    def should_cancel(self):
+        # 没有 should_cancel 的请求（同步接口）不可取消
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return all(f.cancelled() or (should_cancel is not None and should_cancel())
+                   for f, _, _, should_cancel in subscribers)
+
+    def resolve(self, source):
+        """推理结束后把结果（或异常）转交给每个未取消的请求。"""
+        with self._lock:
+            subscribers = [f for f, _, _, _ in self._subscribers]
+        for future in subscribers:
+            try:
+                if source.cancelled():
+                    future.cancel()
+                elif source.exception() is not None:
+                    future.set_exception(source.exception())
+                else:
+                    future.set_result(source.result())
+            except InvalidStateError:
+                pass  # 该请求已自行取消
+
+    def _on_subscriber_done(self, future):
+        if future.cancelled() and self.future is not None and self.should_cancel():
+            self.future.cancel()
+
+
+def _notify_start(on_start):
+    if on_start:
+        try:
+            on_start()
+        except Exception:
+            logging.exception("Batch on_start callback failed")
+
+
+# 缓存键 -> 正在推理的 _SharedInference
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def infer_cached(text, window_size=DEFAULT_WINDOW_SIZE, seed=None, sampling_strategy=None, on_start=None,
+                 on_event=None, should_cancel=None):
+    """先查关节缓存，未命中再交给 batcher 推理；相同的请求正在推理时直接共享其结果。返回 (缓存键, Future)。"""
+    key = result_cache.key(text, window_size, seed, sampling_strategy)
+    joints = result_cache.get_joints(key)
+    if joints is not None:
+        future = Future()
+        future.set_result(joints)
+        return key, future
+
+    with _inflight_lock:
+        shared = _inflight.get(key)
+        if shared is not None:
+            return key, shared.subscribe(on_start, on_event, should_cancel)
+        shared = _inflight[key] = _SharedInference()
+        future = shared.subscribe(on_start, on_event, should_cancel)
+
+    def _done(f):
+        if not f.cancelled() and f.exception() is None:
+            try:
+                result_cache.put_joints(key, f.result())
+            except Exception:
+                logging.exception("Failed to cache joints")
+        # 先写入缓存再移出 _inflight，之后到达的相同请求直接命中缓存
+        with _inflight_lock:
+            if _inflight.get(key) is shared:
+                del _inflight[key]
+        shared.resolve(f)
+
+    shared.future = batcher.submit(text, window_size, seed, sampling_strategy, on_start=shared.on_start,
+                                   on_event=shared.on_event, should_cancel=shared.should_cancel)
+    shared.future.add_done_callback(_done)
+    return key, future
+
+
+# ---------------- 异步任务 ----------------
+# 任务完成后结果保留时长（秒），超时后清理结果文件
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+# 翻译线程数：翻译在独立线程中执行，与当前批次的 GPU 推理重叠
+TRANSLATE_WORKERS = int(os.getenv("TRANSLATE_WORKERS", "4"))
+# 事件流心跳间隔（秒）
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "5"))
+
+
+class Job:
+    """一次生成任务：[translating ->] queued -> running -> rendering -> done / failed / cancelled。
+
+    非 mp4 输出格式跳过 rendering 阶段。
+    """
+
+    TERMINAL_STATUSES = ("done", "failed", "cancelled")
+
+    def __init__(self, request):
+        self.id = str(uuid.uuid4())
+        self.source_text = request.text
+        # 实际送入模型的 prompt，需要翻译时在 translating 阶段结束后更新
+        self.text = request.text
+        self.translate = request.translate
+        self.target_lang = request.target_lang
+        self.output_format = request.format
+        self.dtype = request.dtype
+        self.window_size = request.num_frames
+        self.seed = request.seed
+        self.preview = request.preview
+        self.sampling_strategy = sampling_strategy_for(request)
+        self.renderer = renderer_for(request)
+        # stream 为 True 时改用分片 MP4 渲染器，渲染期间即可通过 /jobs/{id}/stream 边下边播
+        self.stream = request.format == "mp4" and self.renderer == STREAM_RENDERER
+        self.status = "translating" if request.translate else "queued"
+        self.error = None
+        self.result_path = None
+        # 正在编码中的视频路径（仅 stream 任务），渲染完成后由 result_path 取代
+        self.partial_path = None
+        self.result_sha256 = None
+        self.cache_key = None
+        self.cancelled = False
+        # 各阶段正在执行的 Future，取消时用于出队
+        self.futures = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.timings = {}
+        self.events = []
+        # 正在等待新事件的 SSE 连接：(event loop, asyncio.Event)
+        self._waiters = []
+        self._stage_started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set_status(self, status, error=None):
+        """切换阶段，并记录上一阶段耗时。已结束的任务不再改变状态。"""
+        with self._lock:
+            if self.status in self.TERMINAL_STATUSES:
+                return
+            now = time.perf_counter()
+            previous = self.status
+            self.timings[previous] = round(now - self._stage_started, 4)
+            JOB_STAGE_SECONDS.observe(now - self._stage_started, stage=previous)
+            self._stage_started = now
+            self.status = status
+            if error is not None:
+                self.error = error
+            if status in self.TERMINAL_STATUSES:
+                self.finished_at = time.time()
+            self._append_event("status", status=status, error=error,
+                               previous=previous, elapsed=self.timings[previous])
+
+    def emit(self, event, **data):
+        """记录一个进度事件，推送给所有正在监听 /jobs/{id}/events 的客户端。"""
+        with self._lock:
+            self._append_event(event, **data)
+
+    async def wait_events(self, start, timeout):
+        """返回序号 >= start 的事件，没有新事件时最多等待 timeout 秒。
+
+        在 event loop 中等待，监听中的 SSE 连接不占用线程池中的线程。
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if len(self.events) > start:
+                return self.events[start:]
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.remove(waiter)
+        with self._lock:
+            return self.events[start:]
+
+    def _append_event(self, event, **data):
+        data = {k: v for k, v in data.items() if v is not None}
+        self.events.append({"seq": len(self.events), "event": event,
+                            "t": round(time.time() - self.created_at, 4), **data})
+        # 事件由推理 / 渲染线程产生，唤醒需要交给各自的 event loop
+        for loop, waiter in self._waiters:
+            with contextlib.suppress(RuntimeError):
+                # 服务关闭时 event loop 可能已经关闭
+                loop.call_soon_threadsafe(waiter.set)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "format": self.output_format,
+                "prompt": self.text,
+                "num_frames": self.window_size,
+                "seed": self.seed,
+                "preview": self.preview,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "timings": dict(self.timings),
+            }
+
+
+class JobManager:
+    """维护任务表：推理交给 batcher，渲染交给 renderer 进程池，HTTP 线程不再阻塞。"""
+
+    def __init__(self, ttl=JOB_TTL_SECONDS, translate_workers=TRANSLATE_WORKERS):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._translate_executor = ThreadPoolExecutor(max_workers=max(1, translate_workers),
+                                                      thread_name_prefix="translate")
+
+    def submit(self, request):
+        self._purge_expired()
+        job = Job(request)
+        with self._lock:
+            self._jobs[job.id] = job
+        if job.translate:
+            job.futures.append(self._translate_executor.submit(self._translate, job))
+        else:
+            self._dispatch(job)
+        return job
+
+    def cancel(self, job_id):
+        """取消任务：排队中的阶段直接出队，推理中的 batch 若全部取消则在扩散步之间中止。
+
+        正在子进程中编码的视频无法打断，完成后只写入缓存，不再交付。
+        """
+        job = self.get(job_id)
+        if job is None or job.status in Job.TERMINAL_STATUSES:
+            return job
+        job.cancelled = True
+        for future in list(job.futures):
+            future.cancel()
+        job.set_status("cancelled")
+        print(f"Job {job.id} cancelled")
+        return job
+
+    def _translate(self, job):
+        try:
+            job.text, _, skipped = translate_text(job.source_text, job.target_lang)
+        except HTTPException as e:
+            job.set_status("failed", error=f"Translation failed: {e.detail}")
+            return
+        except Exception as e:
+            logging.exception("Translation failed for job %s", job.id)
+            job.set_status("failed", error=f"Translation failed: {e}")
+            return
+        if job.cancelled:
+            return
+        job.emit("translated", prompt=job.text, skipped=skipped or None)
+        job.set_status("queued")
+        self._dispatch(job)
+
+    def _dispatch(self, job):
+        """查缓存并把任务送入推理队列。"""
+        if job.output_format == "mp4":
+            job.cache_key = result_cache.key(job.text, job.window_size, job.seed, job.sampling_strategy)
+            cached_path = result_cache.get_video(job.cache_key, job.renderer)
+            if cached_path:
+                job.result_path = cached_path
+                job.set_status("done")
+                return
+        job.cache_key, future = infer_cached(job.text, job.window_size, job.seed, job.sampling_strategy,
+                                             on_start=lambda: job.set_status("running"),
+                                             on_event=job.emit, should_cancel=lambda: job.cancelled)
+        job.futures.append(future)
+        future.add_done_callback(lambda f: self._on_inferred(job, f))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _on_inferred(self, job, future):
+        # 该回调运行在 batcher 线程中，只负责把渲染转交给进程池，模型立即处理下一批
+        if future.cancelled() or job.cancelled:
+            return
+        error = future.exception()
+        if error is not None:
+            job.set_status("failed", error=str(error))
+            return
+        if job.output_format != "mp4":
+            # 直接输出关节数据，无需渲染
+            try:
+                ext = OUTPUT_FORMATS[job.output_format][1]
+                job.result_path = f"{renderer.output_dir}/{job.id}.{ext}"
+                os.makedirs(renderer.output_dir, exist_ok=True)
+                data = encode_joints(future.result(), job.output_format, job.dtype)
+                with open(job.result_path, "wb") as f:
+                    f.write(data)
+                job.result_sha256 = hashlib.sha256(data).hexdigest()
+                job.set_status("done")
+            except Exception as e:
+                logging.exception("Encoding joints failed for job %s", job.id)
+                job.set_status("failed", error=str(e))
+            return
+        if job.stream:
+            job.partial_path = f"{renderer.output_dir}/{job.id}.mp4"
+        job.set_status("rendering")
+        job.emit("render_started", frames=len(future.result()[0]), stream=job.stream or None)
+        try:
+            render_future = renderer.submit(future.result(), job.text, job.id, job.renderer)
+        except Exception as e:
+            # 在 Future 回调中抛出的异常会被 concurrent.futures 吞掉，任务将一直停在 rendering
+            logging.exception("Submitting render failed for job %s", job.id)
+            ERRORS.inc(stage="render")
+            job.set_status("failed", error=str(e))
+            return
+        job.futures.append(render_future)
+        render_future.add_done_callback(lambda f: self._on_rendered(job, f))
+
+    def _on_rendered(self, job, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            job.result_path = future.result()
+            if not os.path.exists(job.result_path):
+                error = RuntimeError("Video generation failed")
+            else:
+                # 同 _on_inferred：回调中的异常不会传出去，必须在这里把任务标记为失败
+                try:
+                    # 在渲染回调线程中计算摘要，下载请求无需再读一遍整个视频
+                    job.result_sha256 = file_sha256(job.result_path)
+                    try:
+                        job.result_path = result_cache.put_video(job.cache_key, job.result_path, job.renderer)
+                    except Exception:
+                        logging.exception("Failed to cache video")
+                        if not os.path.exists(job.result_path):
+                            raise
+                except Exception as e:
+                    error = e
+        if error is not None:
+            logging.error(f"Render failed for job {job.id}: {error}")
+            if job.partial_path and os.path.exists(job.partial_path):
+                # 流式任务编码到一半留下的文件
+                remove_file(job.partial_path)
+            job.set_status("failed", error=str(error))
+            return
+        job.set_status("done")
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in set(statuses)}
+
+    def _purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            # 缓存中的文件由 ResultCache 负责淘汰
+            if job.result_path and not result_cache.owns(job.result_path):
+                remove_file(job.result_path)
+
+
 # 定义请求体结构
 class MotionRequest(BaseModel):
     text: str
+    # 输出格式：mp4 为渲染视频，其余直接返回关节数组 (2, T, 22, 3)
+    format: Literal["mp4", "npz", "npy-stream", "json"] = "mp4"
+    # 关节数组的数值精度（仅对非 mp4 格式有效）
+    dtype: Literal["float16", "float32"] = "float32"
+    # 是否先在服务端把 text 翻译为 target_lang 再生成（省去客户端单独调用 /translate）
+    translate: bool = False
+    target_lang: str = "English"
+    # mp4 的渲染器：matplotlib 为原有的 plot_3d_motion，native 为快一个数量级的 NumPy + ffmpeg 渲染
+    renderer: Literal["matplotlib", "native"] = DEFAULT_RENDERER
+    # 流式输出（仅 mp4）：用 native 渲染器输出分片 MP4，边编码边返回，客户端收到首个分片即可开始播放
+    stream: bool = False
+    # 生成帧数（30 fps），短片段的推理耗时相应减少
+    num_frames: int = Field(DEFAULT_WINDOW_SIZE, ge=MIN_WINDOW_SIZE, le=MAX_WINDOW_SIZE)
+    # 随机种子：指定后同一 prompt 的结果可复现；为空时每次使用随机噪声（结果仍按 prompt 缓存）
+    seed: Optional[int] = Field(None, ge=0, le=2 ** 31 - 1)
+    # 快速预览：减少扩散采样步数并输出低分辨率、低帧率视频。未指定 seed 时由服务端选定并随结果返回，
+    # 之后用同一 seed（preview=False）即可得到该预览对应的完整质量版本
+    preview: bool = False
+
+
+# 预览使用的采样策略，步数越少越快；完整质量使用配置文件中的策略
+PREVIEW_SAMPLING_STRATEGY = os.getenv("PREVIEW_SAMPLING_STRATEGY", "ddim10")
+# 未指定 seed 的预览是否由服务端选定 seed。带 seed 的请求只能单独推理（见 MotionBatcher._take_batch），
+# 关闭后预览可以合并成 batch，但之后无法再请求与该预览相同的完整版本
+PREVIEW_AUTO_SEED = os.getenv("PREVIEW_AUTO_SEED", "1") == "1"
+
+
+def prepare_request(request):
+    """预览请求未指定 seed 时由服务端生成一个（PREVIEW_AUTO_SEED），客户端据此请求同一 seed 的完整版本。"""
+    if request.preview and request.seed is None and PREVIEW_AUTO_SEED:
+        request.seed = secrets.randbelow(2 ** 31)
+    return request
 
-# 全局变量存储模型实例
+
+def sampling_strategy_for(request):
+    return PREVIEW_SAMPLING_STRATEGY if request.preview else None
+
+
+def renderer_for(request):
+    """请求实际使用的渲染器：预览优先于流式输出，二者都不选时使用请求指定的渲染器。"""
+    if request.preview:
+        return PREVIEW_RENDERER
+    if request.stream:
+        return STREAM_RENDERER
+    return request.renderer
+
+# 全局变量存储模型实例（第一个副本）与多副本批处理调度器
 litmodel = None
+replicas = []
+batcher = None
+renderer = None
+result_cache = None
+jobs = None
+
+# ---------------- 启动 ----------------
+# 转换好键名的 state_dict 缓存目录，为空时每次启动都从原始 checkpoint 转换
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "cache/model")
+# 加载完成后用一个短 prompt 预热每个副本并拉起渲染进程
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+# 在后台线程加载模型：服务立即开始监听，/readyz 在加载与预热完成后才返回 200
+MODEL_LOAD_IN_BACKGROUND = os.getenv("MODEL_LOAD_IN_BACKGROUND", "1") == "1"
+WARMUP_PROMPT = "Two people walk towards each other and shake hands."
+
+# 启动阶段：starting -> loading -> warming_up -> ready / failed
+startup_state = {"status": "starting", "error": None, "started_at": time.time(), "ready_at": None,
+                 "peak_rss_mb": None}
+
+
+def convert_state_dict(state_dict):
+    """把 Lightning checkpoint 的键名转换为模型自身的键名（去掉 "model." 前缀）。"""
+    return {(k.replace("model.", "") if "model" in k else k): v for k, v in state_dict.items()}
+
+
+def _state_cache_path(ckpt_path):
+    # 以路径、大小与修改时间识别 checkpoint，命中时无需重新计算整个文件的哈希
+    st = os.stat(ckpt_path)
+    ident = f"{os.path.abspath(ckpt_path)}:{st.st_size}:{st.st_mtime_ns}"
+    ext = "safetensors" if importlib.util.find_spec("safetensors") else "pt"
+    return os.path.join(MODEL_CACHE_DIR, f"{hashlib.sha256(ident.encode()).hexdigest()[:32]}.{ext}")
+
+
+def _torch_load_mmap(path, **kwargs):
+    """以 mmap 方式加载：张量直接映射文件页，不在内存中再复制一份 checkpoint。"""
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, **kwargs)
+    except (RuntimeError, TypeError) as e:
+        # 旧的非 zip 格式 checkpoint 不支持 mmap
+        print(f"Warning: mmap load unavailable for {path} ({e}), falling back to a full read")
+        return torch.load(path, map_location="cpu", **kwargs)
+
+
+def memory_usage_mb():
+    """返回 (当前 RSS, 峰值 RSS)，单位 MB；平台不支持时为 None。"""
+    current = peak = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if peak is None:
+        try:
+            import resource
+            # Linux 上单位为 KB，macOS 上为字节
+            scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        except ImportError:
+            pass
+    return current, peak
+
+
+def log_memory(stage):
+    current, peak = memory_usage_mb()
+    if peak is not None:
+        startup_state["peak_rss_mb"] = round(peak, 1)
+    fmt = lambda v: "n/a" if v is None else f"{v:.0f} MB"
+    print(f"[memory] {stage}: rss {fmt(current)}, peak {fmt(peak)}")
+
+
+def _read_state_cache(path):
+    if path.endswith(".safetensors"):
+        from safetensors import safe_open
+        with safe_open(path, framework="pt", device="cpu") as f:
+            return {k: f.get_tensor(k) for k in f.keys()}, (f.metadata() or {}).get("model_hash", "")
+    data = _torch_load_mmap(path, weights_only=True)
+    return data["state_dict"], data["model_hash"]
+
+
+def _write_state_cache(path, state_dict, model_hash):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    if path.endswith(".safetensors"):
+        from safetensors.torch import save_file
+        save_file({k: v.contiguous() for k, v in state_dict.items()}, tmp_path,
+                  metadata={"model_hash": model_hash})
+    else:
+        torch.save({"state_dict": state_dict, "model_hash": model_hash}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint_state(ckpt_path):
+    """返回 (转换好键名的 state_dict, checkpoint 的 sha256)。
+
+    第一次启动时读取原始 checkpoint 并转换，结果连同哈希写入 MODEL_CACHE_DIR
+    （装了 safetensors 时为 .safetensors，否则为 .pt）；之后的启动直接读取缓存。
+    """
+    cache_path = _state_cache_path(ckpt_path) if MODEL_CACHE_DIR else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            state_dict, model_hash = _read_state_cache(cache_path)
+            print(f"Loaded converted state dict from {cache_path}")
+            return state_dict, model_hash
+        except Exception as e:
+            print(f"Warning: ignoring unreadable state dict cache {cache_path}: {e}")
+
+    model_hash = file_sha256(ckpt_path)
+    ckpt = _torch_load_mmap(ckpt_path)
+    # 只改键名，张量仍是同一份 mmap 数据
+    state_dict = convert_state_dict(ckpt["state_dict"])
+    del ckpt
+    if cache_path:
+        try:
+            _write_state_cache(cache_path, state_dict, model_hash)
+            print(f"Converted state dict cached at {cache_path}")
+        except Exception as e:
+            print(f"Warning: failed to cache converted state dict: {e}")
+    return state_dict, model_hash
+
 
 # 初始化加载函数
 def load_model_logic():
-    global litmodel
+    """启动钩子：默认在后台线程加载，加载期间生成接口返回 503，/readyz 反映进度。"""
+    if MODEL_LOAD_IN_BACKGROUND:
+        threading.Thread(target=_load_model_guarded, name="model-loader", daemon=True).start()
+    else:
+        _load_model_guarded()
+
+
+def _load_model_guarded():
+    try:
+        _load_models()
+    except Exception as e:
+        startup_state.update(status="failed", error=str(e))
+        logging.exception("Model loading failed")
+        if not MODEL_LOAD_IN_BACKGROUND:
+            raise
+
+
+def _load_models():
+    startup_state["status"] = "loading"
     print("Loading model config and weights...")
     # 这里的路径根据实际文件结构可能需要微调
     model_cfg = get_config("configs/model.yaml")
     infer_cfg = get_config("configs/infer.yaml")
 
     model = build_models(model_cfg)
+    model_hash = ""
 
     if model_cfg.CHECKPOINT:
         # 确保路径存在
         if not os.path.exists(model_cfg.CHECKPOINT):
             print(f"Warning: Checkpoint not found at {model_cfg.CHECKPOINT}")
         else:
-            ckpt = torch.load(model_cfg.CHECKPOINT, map_location="cpu")
-            for k in list(ckpt["state_dict"].keys()):
-                if "model" in k:
-                    ckpt["state_dict"][k.replace("model.", "")] = ckpt["state_dict"].pop(k)
-            model.load_state_dict(ckpt["state_dict"], strict=False)
+            log_memory("model built")
+            state_dict, model_hash = load_checkpoint_state(model_cfg.CHECKPOINT)
+            # assign=True 直接用 checkpoint 张量替换参数，随机初始化的参数立即释放，不再逐个拷贝
+            model.load_state_dict(state_dict, strict=False, assign=True)
+            del state_dict
             print("Checkpoint state loaded!")
+            log_memory("checkpoint loaded")
+
+    # 每个设备一个 Lightning 模型副本，权重只从磁盘加载一次
+    devices = resolve_devices()
+    if any(device.type == "cpu" for device in devices):
+        configure_cpu_runtime()
+    base = LitGenModel(model, infer_cfg)
+    new_replicas = []
+    # 逐个复制并移到目标设备，CPU 上同时最多只有基础模型外加一份副本
+    for i, device in enumerate(devices):
+        replica = base if i == len(devices) - 1 else copy.deepcopy(base)
+        replica = replica.to(device)
+        if device.type == "cpu":
+            replica = prepare_cpu_replica(replica)
+        new_replicas.append(replica)
+        print(f"Model replica {i} ready on {device}")
+    del base, model
+    log_memory("replicas ready")
+    if CPU_PRECISION != "fp32" and any(device.type == "cpu" for device in devices):
+        # 低精度推理结果与 fp32 不同，不能共用缓存
+        model_hash = f"{model_hash}:{CPU_PRECISION}"
+    start_pipeline(new_replicas, model_hash)
+
+
+def start_pipeline(new_replicas, model_hash="", warmup=MODEL_WARMUP, render_workers=RENDER_WORKERS,
+                   cache_dir=RESULT_CACHE_DIR, cache_max_bytes=RESULT_CACHE_MAX_BYTES):
+    """在已加载好的模型副本上组装批处理、渲染、缓存与任务管理，并把服务标记为就绪。
+
+    load_model_logic 与压测脚本 bench_api.py（使用 CPU stub 模型）共用这一步。
+    """
+    global litmodel, replicas, batcher, renderer, result_cache, jobs
+    new_renderer = RenderPool(render_workers)
+
+    if warmup:
+        # 第一次 forward 会触发 CUDA 上下文、cuDNN 算法选择等一次性开销，提前在这里付掉
+        startup_state["status"] = "warming_up"
+        for i, replica in enumerate(new_replicas):
+            t0 = time.perf_counter()
+            replica.generate_batch([WARMUP_PROMPT], DEFAULT_WINDOW_SIZE)
+            print(f"Replica {i} warmed up in {time.perf_counter() - t0:.2f}s")
+        t0 = time.perf_counter()
+        new_renderer.warm_up()
+        print(f"Render workers started in {time.perf_counter() - t0:.2f}s")
 
-    # 初始化 Lightning 模型并移至 GPU
-    litmodel = LitGenModel(model, infer_cfg).to(torch.device("cuda:0"))
-    print("Model loaded successfully!")
+    replicas = new_replicas
+    renderer = new_renderer
+    result_cache = ResultCache(cache_dir, cache_max_bytes, model_hash=model_hash)
+    jobs = JobManager()
+    # 最后才设置 batcher / litmodel：请求处理以它们判断模型是否就绪
+    batcher = ReplicaPool([(m.device, m.generate_batch) for m in replicas])
+    litmodel = replicas[0]
+    log_memory("startup finished")
+    startup_state.update(status="ready", ready_at=time.time())
+    print(f"Model loaded successfully in {startup_state['ready_at'] - startup_state['started_at']:.1f}s!")
 
 # 定义清理临时文件的函数
 def remove_file(path: str):
@@ -140,35 +1751,100 @@ def remove_file(path: str):
 # 创建 FastAPI 应用，并在启动时加载模型
 app = FastAPI(on_startup=[load_model_logic])
 
+
+# 响应体为结果文件（视频或关节数据）的路由，统计其传输耗时
+_TRANSFER_ROUTES = ("/generate_motion", "/jobs/{job_id}/result", "/jobs/{job_id}/stream")
+
+
+async def _timed_body(body_iterator, route):
+    """从第一块到最后一块响应体的耗时计入 TRANSFER_SECONDS；客户端中途断开时不计。"""
+    started = None
+    async for chunk in body_iterator:
+        if started is None:
+            started = time.perf_counter()
+        yield chunk
+    if started is not None:
+        TRANSFER_SECONDS.observe(time.perf_counter() - started, route=route)
+
+
+@app.middleware("http")
+async def count_requests(request: Request, call_next):
+    response = await call_next(request)
+    # 用路由模板而不是实际路径作标签，避免任务 ID 撑爆指标
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    if route in _TRANSFER_ROUTES and 200 <= response.status_code < 300:
+        response.body_iterator = _timed_body(response.body_iterator, route)
+    return response
+
 @app.post("/generate_motion")
 def generate_motion_endpoint(request: MotionRequest, background_tasks: BackgroundTasks):
     """
-    输入文本，返回生成的 MP4 视频。
+    输入文本，返回生成的 MP4 视频；format 为 npz / npy-stream / json 时直接返回关节数据。
+    translate 为 True 时先在服务端翻译再生成。
+    请求带有 seed（或 preview 时由服务端选定）时，响应头 X-Motion-Seed 返回所用的 seed。
     """
     if not litmodel:
-        raise HTTPException(status_code=500, detail="Model not loaded")
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    prepare_request(request)
+    seed_headers = {"X-Motion-Seed": str(request.seed)} if request.seed is not None else {}
     
     # 1. 生成唯一的任务ID，防止文件名冲突
     task_id = str(uuid.uuid4())
+
+    if request.translate:
+        request.text, _, _ = translate_text(request.text, request.target_lang)
     
     try:
-        # 2. 调用模型推理
-        # 注意：generate_one_sample 内部是在 results/ 目录下创建文件
+        # 2. 命中视频缓存时直接返回，无需推理与渲染
+        video_renderer = renderer_for(request)
+        sampling_strategy = sampling_strategy_for(request)
+        if request.format == "mp4":
+            cached_path = result_cache.get_video(
+                result_cache.key(request.text, request.num_frames, request.seed, sampling_strategy), video_renderer)
+            if cached_path:
+                return FileResponse(
+                    path=cached_path,
+                    media_type="video/mp4",
+                    filename=f"motion_{task_id}.mp4",
+                    headers=seed_headers
+                )
+
+        # 3. 提交到批处理队列（关节缓存未命中时），与其它并发请求合并推理
+        cache_key, future = infer_cached(request.text, request.num_frames, request.seed, sampling_strategy)
+        motion_output = future.result()
+
+        if request.format != "mp4":
+            # 跳过渲染，直接返回两人的关节数组
+            media_type, ext = OUTPUT_FORMATS[request.format]
+            return Response(
+                content=encode_joints(motion_output, request.format, request.dtype),
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="motion_{task_id}.{ext}"', **seed_headers}
+            )
+
+        if video_renderer == STREAM_RENDERER:
+            return _stream_render(motion_output, request.text, task_id, cache_key, background_tasks, seed_headers)
+
+        # 注意：渲染进程在 results/ 目录下创建文件
         # 我们传入 task_id 作为 name，文件将是 results/{task_id}.mp4
-        file_path = litmodel.generate_one_sample(request.text, task_id)
+        file_path = renderer.submit(motion_output, request.text, task_id, video_renderer).result()
         
-        # 3. 验证文件是否生成
+        # 4. 验证文件是否生成
         if not os.path.exists(file_path):
             raise HTTPException(status_code=500, detail="Video generation failed")
         
-        # 4. 设置后台任务：在响应发送给用户后，删除服务器上的临时视频文件
-        background_tasks.add_task(remove_file, file_path)
+        # 5. 移入结果缓存；缓存关闭时在响应发送后删除服务器上的临时视频文件
+        file_path = result_cache.put_video(cache_key, file_path, video_renderer)
+        if not result_cache.owns(file_path):
+            background_tasks.add_task(remove_file, file_path)
         
-        # 5. 返回文件流
+        # 6. 返回文件流
         return FileResponse(
             path=file_path, 
             media_type="video/mp4", 
-            filename=f"motion_{task_id}.mp4"
+            filename=f"motion_{task_id}.mp4",
+            headers=seed_headers
         )
 
     except Exception as e:
@@ -176,33 +1852,561 @@ def generate_motion_endpoint(request: MotionRequest, background_tasks: Backgroun
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _tail_file(get_path, is_finished, chunk_size=256 * 1024):
+    """持续读取一个正在被写入的文件，直到写入结束且已读到末尾。
+
+    get_path() 返回文件当前路径（渲染完成后文件会被移入缓存目录，路径随之改变），
+    is_finished() 为 True 表示文件不会再增长。
+    """
+    offset = 0
+    while True:
+        # 先取状态再读：结束前写入的最后一段数据一定能被这一轮读到
+        finished = is_finished()
+        path = get_path()
+        chunk = b""
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    chunk = f.read(chunk_size)
+            except FileNotFoundError:
+                # 编码尚未创建文件，或文件正被移入缓存目录
+                pass
+        if chunk:
+            offset += len(chunk)
+            yield chunk
+        elif finished:
+            return
+        else:
+            # 不能用 time.sleep：等待期间会一直占住线程池中的线程
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+
+def _stream_render(motion_output, caption, task_id, cache_key, background_tasks, headers=None):
+    """提交分片 MP4 渲染，编码器写出第一段数据后即返回流式响应，客户端无需等待编码完成。"""
+    render_future = renderer.submit(motion_output, caption, task_id, STREAM_RENDERER)
+    partial_path = f"{renderer.output_dir}/{task_id}.mp4"
+    state = {"path": partial_path, "done": False}
+
+    def on_rendered(future):
+        try:
+            if future.exception() is None and os.path.exists(future.result()):
+                state["path"] = result_cache.put_video(cache_key, future.result(), STREAM_RENDERER)
+            else:
+                logging.error(f"Streaming render failed for {task_id}: {future.exception()}")
+        except Exception:
+            logging.exception("Failed to cache video")
+        finally:
+            state["done"] = True
+
+    def cleanup():
+        # 响应发送完毕后才执行；缓存关闭时删除服务器上的临时视频文件
+        try:
+            render_future.result()
+        except Exception:
+            pass
+        if not result_cache.owns(state["path"]):
+            remove_file(state["path"])
+
+    render_future.add_done_callback(on_rendered)
+    # 响应头发出之后就无法再报告错误：先等到有数据可发，期间渲染失败（如缺少 ffmpeg）则返回 500
+    while not state["done"]:
+        try:
+            if os.path.getsize(partial_path) > 0:
+                break
+        except OSError:
+            pass
+        time.sleep(STREAM_POLL_SECONDS)
+    if state["done"] and render_future.exception() is not None:
+        if os.path.exists(partial_path):
+            remove_file(partial_path)
+        raise RuntimeError(f"Video generation failed: {render_future.exception()}")
+    background_tasks.add_task(cleanup)
+    return StreamingResponse(_tail_file(lambda: state["path"], lambda: state["done"]),
+                             media_type="video/mp4", background=background_tasks,
+                             headers={"Content-Disposition": f'inline; filename="motion_{task_id}.mp4"',
+                                      "Cache-Control": "no-cache", **(headers or {})})
+
+
+@app.post("/jobs")
+def submit_job_endpoint(request: MotionRequest):
+    """提交生成任务，立即返回任务 ID，之后通过 GET /jobs/{id} 轮询状态。
+
+    translate 为 True 时翻译作为任务的第一个阶段在服务端执行，并与其它任务的推理并行。
+    preview 任务的 seed 在返回的任务信息中给出。
+    """
+    if not litmodel:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    job = jobs.submit(prepare_request(request))
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}")
+def get_job_endpoint(job_id: str):
+    """查询任务状态：queued / running / rendering / done / failed，以及各阶段耗时。"""
+    job = jobs.get(job_id) if jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job_endpoint(job_id: str):
+    """取消任务，释放其在推理队列与渲染队列中的位置。"""
+    job = jobs.cancel(job_id) if jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events_endpoint(job_id: str, since: int = 0):
+    """以 Server-Sent Events 推送任务进度：排队位置、翻译完成、扩散步 k/N、后处理、渲染、上传字节数。
+
+    每个事件都带有相对任务创建时间的 t（秒），可直接作为分阶段耗时数据。
+    since 为上次收到的事件序号 + 1，断线重连时只补发之后的事件。
+    任务失败、取消或结果上传完毕后流结束。
+    """
+    job = jobs.get(job_id) if jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        seq = max(0, since)
+        while jobs.get(job_id) is job:
+            events = await job.wait_events(seq, timeout=SSE_KEEPALIVE_SECONDS)
+            if not events:
+                # 心跳，顺便让服务端及时发现客户端已断开
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                seq = event["seq"] + 1
+                yield f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if event["event"] == "uploaded" or event.get("status") in ("failed", "cancelled"):
+                    return
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/jobs/{job_id}/stream")
+def job_stream_endpoint(job_id: str):
+    """边编码边下载 mp4 结果，可直接交给播放器打开。
+
+    stream 任务在 rendering 阶段即开始返回分片 MP4；其它 mp4 任务等结果完成后整体返回。
+    任务失败或取消时流提前结束。
+    """
+    job = jobs.get(job_id) if jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.output_format != "mp4":
+        raise HTTPException(status_code=400, detail="Only mp4 results can be streamed")
+    if job.status in ("failed", "cancelled"):
+        raise HTTPException(status_code=410, detail=job.error or f"Job {job.status}")
+
+    def current_path():
+        # result_path 在渲染完成并移入缓存后才设置
+        return job.result_path or job.partial_path
+
+    def finished():
+        return job.status in Job.TERMINAL_STATUSES
+
+    return StreamingResponse(_tail_file(current_path, finished), media_type="video/mp4",
+                             headers={"Content-Disposition": f'inline; filename="motion_{job.id}.mp4"',
+                                      "Cache-Control": "no-cache"})
+
+
+def _iter_result_file(job, start, end, chunk_size=256 * 1024):
+    """分块读取结果文件的 [start, end] 区间，同时上报已发送字节数。"""
+    total = os.path.getsize(job.result_path)
+    sent = start
+    with open(job.result_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            yield chunk
+            remaining -= len(chunk)
+            sent += len(chunk)
+            job.emit("upload", bytes=sent, total=total)
+    if sent == total:
+        job.emit("uploaded", bytes=sent)
+
+
+def _parse_range(range_header, size):
+    """解析单区间的 Range 头（bytes=a-b / bytes=a- / bytes=-n），返回 (start, end)；无法满足时返回 None。"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start = size - int(last)
+            end = size - 1
+    except ValueError:
+        return None
+    start = max(0, start)
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result_endpoint(job_id: str, request: Request):
+    """下载任务结果。结果在 JOB_TTL_SECONDS 内可重复下载，断线后无需重新推理。
+
+    支持 Range / If-Range 断点续传；ETag 与 X-Content-SHA256 为文件内容的 sha256，供客户端校验。
+    """
+    job = jobs.get(job_id) if jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error or "Generation failed")
+    if job.status == "cancelled":
+        raise HTTPException(status_code=410, detail="Job was cancelled")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished: {job.status}")
+    if not os.path.exists(job.result_path):
+        raise HTTPException(status_code=410, detail="Result has been evicted")
+    if job.result_sha256 is None:
+        # 只有直接命中视频缓存的任务没有在生成时计算摘要
+        job.result_sha256 = file_sha256(job.result_path)
+
+    media_type, ext = OUTPUT_FORMATS[job.output_format]
+    size = os.path.getsize(job.result_path)
+    etag = f'"{job.result_sha256}"'
+    headers = {
+        "ETag": etag,
+        "X-Content-SHA256": job.result_sha256,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="motion_{job.id}.{ext}"',
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range 与当前 ETag 不一致说明文件已变化，按完整下载处理
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _iter_result_file(job, start, end),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers
+    )
+
+
+@app.get("/stats")
+def stats_endpoint():
+    """流水线各阶段的队列深度，便于观察瓶颈在推理还是渲染。"""
+    if not batcher:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return {
+        "inference": batcher.stats(),
+        "render": renderer.stats(),
+        "jobs": jobs.stats(),
+        "cache": result_cache.stats(),
+        "translation_cache": translation_cache.stats(),
+    }
+
+
+def _collect_scrape_metrics():
+    """把 /stats 中的队列、缓存与任务状态，以及进程 / GPU 内存，转换为抓取时计算的指标。"""
+    def inference():
+        for replica in (batcher.stats()["replicas"] if batcher else []):
+            labels = {"replica": replica["name"], "device": replica["device"]}
+            yield "motion_inference_queue_depth", "gauge", labels, replica["queue_depth"]
+            yield "motion_inference_in_flight", "gauge", labels, replica["in_flight"]
+            yield "motion_replica_utilization", "gauge", labels, replica["utilization"]
+
+    def render():
+        if renderer:
+            stats = renderer.stats()
+            yield "motion_render_in_flight", "gauge", {}, stats["in_flight"]
+            yield "motion_render_queue_depth", "gauge", {}, stats["queue_depth"]
+
+    def job_counts():
+        if jobs:
+            for status, count in jobs.stats().items():
+                yield "motion_jobs", "gauge", {"status": status}, count
+
+    def caches():
+        if result_cache:
+            stats = result_cache.stats()
+            for kind in stats["hits"]:
+                yield "motion_cache_hits_total", "counter", {"cache": kind}, stats["hits"][kind]
+                yield "motion_cache_misses_total", "counter", {"cache": kind}, stats["misses"][kind]
+            yield "motion_cache_bytes", "gauge", {"cache": "result"}, stats["bytes"]
+        stats = translation_cache.stats()
+        yield "motion_cache_hits_total", "counter", {"cache": "translation"}, stats["hits"]
+        yield "motion_cache_misses_total", "counter", {"cache": "translation"}, stats["misses"]
+
+    def memory():
+        current, peak = memory_usage_mb()
+        if current is not None:
+            yield "motion_process_resident_memory_bytes", "gauge", {}, int(current * 1024 * 1024)
+        if peak is not None:
+            yield "motion_process_peak_resident_memory_bytes", "gauge", {}, int(peak * 1024 * 1024)
+        if torch.cuda.is_available():
+            for i in range(torch.cuda.device_count()):
+                labels = {"device": f"cuda:{i}"}
+                yield "motion_gpu_memory_allocated_bytes", "gauge", labels, torch.cuda.memory_allocated(i)
+                yield "motion_gpu_memory_reserved_bytes", "gauge", labels, torch.cuda.memory_reserved(i)
+                yield "motion_gpu_memory_peak_allocated_bytes", "gauge", labels, torch.cuda.max_memory_allocated(i)
+
+    return [inference, render, job_counts, caches, memory]
+
+
+_SCRAPE_HELP = {
+    "motion_inference_queue_depth": "Prompts waiting for a batch, per replica.",
+    "motion_inference_in_flight": "Prompts in the running batch, per replica.",
+    "motion_replica_utilization": "Fraction of time each replica has spent running batches.",
+    "motion_render_in_flight": "Render tasks submitted and not yet finished.",
+    "motion_render_queue_depth": "Render tasks waiting for a free worker.",
+    "motion_jobs": "Jobs currently tracked, by status.",
+    "motion_cache_hits_total": "Cache hits by cache.",
+    "motion_cache_misses_total": "Cache misses by cache.",
+    "motion_cache_bytes": "Bytes stored in the result cache.",
+    "motion_process_resident_memory_bytes": "Resident memory of the API process.",
+    "motion_process_peak_resident_memory_bytes": "Peak resident memory of the API process.",
+    "motion_gpu_memory_allocated_bytes": "GPU memory allocated by tensors.",
+    "motion_gpu_memory_reserved_bytes": "GPU memory reserved by the caching allocator.",
+    "motion_gpu_memory_peak_allocated_bytes": "Peak GPU memory allocated by tensors.",
+}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus 文本格式的指标：各阶段耗时直方图、错误 / 请求计数、队列、缓存与内存。"""
+    grouped = OrderedDict()
+    for collect in _collect_scrape_metrics():
+        try:
+            for name, kind, labels, value in collect():
+                grouped.setdefault((name, kind), []).append((labels, value))
+        except Exception:
+            logging.exception("Failed to collect metrics")
+    lines = [metrics.render().rstrip("\n")]
+    for (name, kind), samples in grouped.items():
+        lines.append(f"# HELP {name} {_SCRAPE_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/healthz")
+def healthz_endpoint():
+    """存活探针：进程能响应即返回 200。"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz_endpoint():
+    """就绪探针：模型加载并预热完成前返回 503，负载均衡只把流量转发给已就绪的实例。"""
+    state = dict(startup_state)
+    if state["status"] != "ready":
+        raise HTTPException(status_code=503, detail=state)
+    return state
+
+
 # ---------------- 翻译接口（千问） ----------------
-class TranslateRequest(PydanticBaseModel):
-    text: str
-    target_lang: str = "English"
+# 翻译缓存：内存 LRU 条目数、过期时间（秒）；TRANSLATE_CACHE_DB 非空时额外持久化到 SQLite
+TRANSLATE_CACHE_SIZE = int(os.getenv("TRANSLATE_CACHE_SIZE", "4096"))
+TRANSLATE_CACHE_TTL = float(os.getenv("TRANSLATE_CACHE_TTL", str(7 * 24 * 3600)))
+TRANSLATE_CACHE_DB = os.getenv("TRANSLATE_CACHE_DB", "")
+TRANSLATE_CACHE_DB_MAX_ENTRIES = int(os.getenv("TRANSLATE_CACHE_DB_MAX_ENTRIES", "100000"))
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "30"))
 
 
-@app.post("/translate")
-def translate_endpoint(req: TranslateRequest):
-    """使用千问（Dashscope）的大模型翻译文本。
+class TranslationCache:
+    """(text, target_lang) -> 译文 的缓存：内存 LRU + 可选的 SQLite 持久化，均带 TTL。"""
+
+    def __init__(self, max_entries=TRANSLATE_CACHE_SIZE, ttl=TRANSLATE_CACHE_TTL,
+                 db_path=TRANSLATE_CACHE_DB, db_max_entries=TRANSLATE_CACHE_DB_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_max_entries = db_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # (text, target_lang) -> (translation, created_at)
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "text TEXT NOT NULL, target_lang TEXT NOT NULL, translation TEXT NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (text, target_lang))"
+            )
+            self._db.commit()
+
+    def get(self, text, target_lang):
+        key = (text, target_lang)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._memory.pop(key, None)
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT translation, created_at FROM translations WHERE text = ? AND target_lang = ?",
+                    key
+                ).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
 
-    环境变量：
+    def put(self, text, target_lang, translation):
+        key = (text, target_lang)
+        now = time.time()
+        with self._lock:
+            self._remember(key, translation, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                    (text, target_lang, translation, now)
+                )
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._prune_db(now)
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, key, translation, created_at):
+        self._memory[key] = (translation, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _prune_db(self, now):
+        self._db.execute("DELETE FROM translations WHERE created_at < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM translations WHERE rowid NOT IN "
+            "(SELECT rowid FROM translations ORDER BY created_at DESC LIMIT ?)",
+            (self.db_max_entries,)
+        )
+
+
+# 长连接的翻译客户端（内部复用 TLS 会话与连接池）与翻译缓存，启动时创建
+translate_client = None
+translation_cache = TranslationCache()
+
+
+def init_translation():
+    """环境变量：
       - DASHSCOPE_API_KEY: API Key（必需）
-      - DASHSCOPE_BASE_URL: 可选，覆盖默认 base_url（如中国/新加坡地域）
+      - DASHSCOPE_BASE_URL: 可选，覆盖默认 base_url（如中国/新加坡地域，或本地的兼容服务）
     """
+    global translate_client
+    from openai import OpenAI
     api_key = os.getenv("DASHSCOPE_API_KEY")
     if not api_key:
-        raise HTTPException(status_code=500, detail="DASHSCOPE_API_KEY not configured")
-
+        print("Warning: DASHSCOPE_API_KEY not configured, /translate is disabled")
+        return
     base_url = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+    translate_client = OpenAI(api_key=api_key, base_url=base_url, timeout=TRANSLATE_TIMEOUT)
 
-    try:
-        client = OpenAI(api_key=api_key, base_url=base_url)
 
-        messages = [{"role": "user", "content": req.text}]
-        translation_options = {"source_lang": "auto", "target_lang": req.target_lang}
+app.router.on_startup.append(init_translation)
+
 
-        completion = client.chat.completions.create(
+# 英语常见的虚词与人称词。纯 ASCII 文本只有在这些词占一定比例时才判为英语，
+# 不带重音符号的西班牙语、德语、法语等仍交给翻译服务
+_ENGLISH_WORDS = frozenset("""
+a an the and or but of to in on at by for from with into onto towards toward while then as
+is are was were be been being it its he she his her him they them their each other both
+one two person people someone
+""".split())
+_ENGLISH_WORD_RATIO = 0.25
+
+
+def detect_language(text):
+    """基于字符所属文字体系的快速语言判断，返回与 target_lang 同名的语言，无法确定时返回 None（照常翻译）。"""
+    counts = {"han": 0, "kana": 0, "hangul": 0, "cyrillic": 0, "ascii": 0, "other": 0}
+    for ch in text:
+        if not ch.isalpha():
+            continue
+        code = ord(ch)
+        if code < 128:
+            counts["ascii"] += 1
+        elif 0x3040 <= code <= 0x30FF:
+            counts["kana"] += 1
+        elif 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF:
+            counts["han"] += 1
+        elif 0xAC00 <= code <= 0xD7AF or 0x1100 <= code <= 0x11FF:
+            counts["hangul"] += 1
+        elif 0x0400 <= code <= 0x04FF:
+            counts["cyrillic"] += 1
+        else:
+            counts["other"] += 1
+    total = sum(counts.values())
+    if total == 0:
+        return None
+    if counts["kana"]:
+        return "Japanese"
+    if counts["hangul"] / total > 0.3:
+        return "Korean"
+    if counts["han"] / total > 0.3:
+        return "Chinese"
+    if counts["cyrillic"] / total > 0.5:
+        return "Russian"
+    # 纯 ASCII 字母且含有足够多的英语虚词才视为英语（带重音符号的欧洲语言会落到 other）
+    if counts["ascii"] == total:
+        words = ["".join(c for c in w if c.isalpha() or c == "'") for w in text.lower().split()]
+        words = [w for w in words if w]
+        hits = sum(1 for w in words if w in _ENGLISH_WORDS)
+        if hits and hits >= _ENGLISH_WORD_RATIO * len(words):
+            return "English"
+    return None
+
+
+def translate_text(text, target_lang="English"):
+    """翻译文本，优先命中缓存。返回 (译文, 是否命中缓存, 是否跳过翻译)，失败时抛出 HTTPException。
+
+    已经是目标语言的文本直接原样返回，不调用远程服务。
+    """
+    detected = detect_language(text)
+    if detected and detected.lower() == target_lang.lower():
+        print(f"Skip translation: text already in {target_lang}")
+        return text, False, True
+
+    cached = translation_cache.get(text, target_lang)
+    if cached is not None:
+        return cached, True, False
+
+    if translate_client is None:
+        raise HTTPException(status_code=500, detail="DASHSCOPE_API_KEY not configured")
+
+    started = time.perf_counter()
+    try:
+        messages = [{"role": "user", "content": text}]
+        translation_options = {"source_lang": "auto", "target_lang": target_lang}
+
+        completion = translate_client.chat.completions.create(
             model="qwen-mt-flash",
             messages=messages,
             extra_body={
@@ -220,11 +2424,26 @@ def translate_endpoint(req: TranslateRequest):
         if not translated:
             raise HTTPException(status_code=502, detail="Translation service returned empty response")
 
-        return {"translation": translated}
-
     except Exception as e:
         logging.exception("Translation API error")
+        ERRORS.inc(stage="translation")
         raise HTTPException(status_code=502, detail=str(e))
+    TRANSLATION_SECONDS.observe(time.perf_counter() - started)
+
+    translation_cache.put(text, target_lang, translated)
+    return translated, False, False
+
+
+class TranslateRequest(PydanticBaseModel):
+    text: str
+    target_lang: str = "English"
+
+
+@app.post("/translate")
+def translate_endpoint(req: TranslateRequest):
+    """使用千问（Dashscope）的大模型翻译文本，重复文本直接返回缓存结果。"""
+    translated, cached, skipped = translate_text(req.text, req.target_lang)
+    return {"translation": translated, "cached": cached, "skipped": skipped}
 
 if __name__ == "__main__":
     # 启动服务
@@ -0,0 +1,360 @@
+"""api_1_1.py 压测脚本。
+
+用确定性的 CPU stub 替换 InterGen 与 plot_3d_motion，用本地假翻译服务替换千问，
+在本进程内启动 FastAPI app，按给定并发与 prompt 组合发请求，
+以 JSON 输出延迟分位数、吞吐与各阶段耗时，便于比较批处理 / 缓存等改动前后的表现。
+
+示例：
+    python bench_api.py --requests 200 --concurrency 16 --unique 50 --translate-ratio 0.3
+    python bench_api.py --mode sync --formats npz --output bench.json
+"""
+import os
+import sys
+import time
+import json
+import random
+import socket
+import tempfile
+import argparse
+import threading
+import zlib
+import contextlib
+from types import ModuleType, SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+# stub 的耗时参数通过环境变量传递，spawn 出来的渲染子进程也能读到
+STEP_MS_ENV = "BENCH_STEP_MS"
+BATCH_COST_ENV = "BENCH_BATCH_COST"
+RENDER_MS_ENV = "BENCH_RENDER_MS"
+VIDEO_KB_ENV = "BENCH_VIDEO_KB"
+
+MOTION_DIM = 262
+
+
+class StubMotionNormalizer:
+    motion_mean = np.zeros(MOTION_DIM, dtype=np.float32)
+    motion_std = np.ones(MOTION_DIM, dtype=np.float32)
+
+    def backward(self, x):
+        return x * self.motion_std + self.motion_mean
+
+
+class StubInterGen(torch.nn.Module):
+    """与 InterGen 接口一致的 CPU stub：输出由 prompt 决定，每个扩散步按配置的耗时睡眠。
+
+    每步耗时 = BENCH_STEP_MS * (1 + BENCH_BATCH_COST * (B - 1))，模拟 GPU 上批量推理的边际成本。
+    """
+
+    def __init__(self, cfg=None, steps=50):
+        super().__init__()
+        self.decoder = torch.nn.Module()
+        self.decoder.net = torch.nn.Linear(2 * MOTION_DIM, 2 * MOTION_DIM)
+        self.decoder.sampling_strategy = f"ddim{steps}"
+        self.steps = steps
+        with torch.no_grad():
+            self.decoder.net.weight.copy_(torch.eye(2 * MOTION_DIM) * 0.99)
+            self.decoder.net.bias.zero_()
+
+    def forward_test(self, batch):
+        T = int(batch["motion_lens"][0])
+        device = batch["motion_lens"].device
+        noise = []
+        for text in batch["text"]:
+            generator = torch.Generator().manual_seed(zlib.crc32(text.encode("utf-8")))
+            noise.append(torch.randn(T, 2 * MOTION_DIM, generator=generator))
+        x = torch.stack(noise).to(device)
+        step_seconds = float(os.getenv(STEP_MS_ENV, "20")) / 1000.0
+        step_seconds *= 1 + float(os.getenv(BATCH_COST_ENV, "0.1")) * (len(noise) - 1)
+        # 与 InterGen 一样每次按当前的 sampling_strategy 决定步数（预览请求会临时换成更少的步数）
+        digits = "".join(c for c in self.decoder.sampling_strategy if c.isdigit())
+        for _ in range(int(digits) if digits else self.steps):
+            started = time.perf_counter()
+            x = self.decoder.net(x)
+            remaining = step_seconds - (time.perf_counter() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+        batch["output"] = x
+        return batch
+
+
+def stub_plot_3d_motion(save_path, kinematic_tree, mp_joints, title, figsize=(10, 10), fps=120, radius=4):
+    """代替 matplotlib 渲染：睡眠 BENCH_RENDER_MS 毫秒后写出与关节数据相关的固定大小文件。"""
+    time.sleep(float(os.getenv(RENDER_MS_ENV, "500")) / 1000.0)
+    seed = zlib.crc32(np.ascontiguousarray(mp_joints[0]).tobytes())
+    payload = np.random.default_rng(seed).bytes(int(float(os.getenv(VIDEO_KB_ENV, "256")) * 1024))
+    with open(save_path, "wb") as f:
+        f.write(payload)
+
+
+def install_stubs():
+    """在导入 api_1_1 之前注入 models / utils / configs 的 stub 模块。
+
+    放在模块顶层执行：渲染进程以 spawn 方式重新导入本脚本时也会装上同样的 stub。
+    """
+    def module(name, **attrs):
+        m = ModuleType(name)
+        m.__dict__.update(attrs)
+        sys.modules[name] = m
+        return m
+
+    module("models", InterGen=StubInterGen, MotionNormalizer=StubMotionNormalizer)
+    utils = module("utils", __path__=[])
+    utils.paramUtil = module("utils.paramUtil", t2m_kinematic_chain=[[0, 2, 5, 8, 11], [0, 1, 4, 7, 10],
+                                                                     [0, 3, 6, 9, 12, 15],
+                                                                     [9, 14, 17, 19, 21], [9, 13, 16, 18, 20]])
+    utils.plot_script = module("utils.plot_script", plot_3d_motion=stub_plot_3d_motion)
+    utils.preprocess = module("utils.preprocess")
+    module("configs", get_config=lambda path: None)
+
+
+install_stubs()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import api_1_1 as api  # noqa: E402
+import requests  # noqa: E402
+import uvicorn  # noqa: E402
+
+
+class StubTranslateClient:
+    """与 OpenAI 客户端 chat.completions.create 接口一致的本地翻译服务，固定延迟。"""
+
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, extra_body=None, **kwargs):
+        time.sleep(self.latency)
+        text = messages[0]["content"]
+        message = SimpleNamespace(content=f"Translated motion: {zlib.crc32(text.encode('utf-8'))}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def parse_formats(spec):
+    """"mp4:0.7,npz:0.3" -> [("mp4", 0.7), ("npz", 0.3)]，未写权重时均分。"""
+    pairs = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if name:
+            pairs.append((name, float(weight) if weight else 1.0))
+    return pairs
+
+
+def build_workload(args):
+    """生成确定性的请求序列：unique 个不同的 prompt 循环复用（复用部分命中缓存），
+    其中 translate_ratio 比例为中文 prompt 并要求服务端翻译。"""
+    rng = random.Random(args.seed)
+    if args.prompts_file:
+        with open(args.prompts_file, encoding="utf-8") as f:
+            base = [line.strip() for line in f if line.strip()]
+    else:
+        base = [f"Two people walk towards each other and shake hands, variation {i}."
+                for i in range(args.unique or args.requests)]
+    pool = []
+    for i, prompt in enumerate(base):
+        translate = rng.random() < args.translate_ratio
+        pool.append({"text": f"两个人相向而行并握手，第{i}种动作。" if translate else prompt,
+                     "translate": translate})
+    names, weights = zip(*parse_formats(args.formats))
+    workload = []
+    for i in range(args.requests):
+        item = dict(pool[i % len(pool)] if args.unique else pool[i])
+        item["format"] = rng.choices(names, weights)[0]
+        item["renderer"] = args.renderer
+        workload.append(item)
+    rng.shuffle(workload)
+    return workload
+
+
+def run_sync_request(session, base_url, item):
+    started = time.perf_counter()
+    response = session.post(f"{base_url}/generate_motion", json=item, timeout=600)
+    response.raise_for_status()
+    return {"latency": time.perf_counter() - started, "bytes": len(response.content), "stages": {}}
+
+
+def run_job_request(session, base_url, item):
+    """POST /jobs，监听事件流直到结束状态，再下载结果。"""
+    started = time.perf_counter()
+    response = session.post(f"{base_url}/jobs", json=item, timeout=60)
+    response.raise_for_status()
+    job_id = response.json()["id"]
+    status = response.json()["status"]
+    if status not in ("done", "failed", "cancelled"):
+        with session.get(f"{base_url}/jobs/{job_id}/events", stream=True, timeout=600) as events:
+            for line in events.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    event = json.loads(line[5:])
+                    if event.get("event") == "status" and event.get("status") in ("done", "failed", "cancelled"):
+                        status = event["status"]
+                        break
+    if status != "done":
+        raise RuntimeError(f"job {job_id} {status}")
+    transfer_started = time.perf_counter()
+    result = session.get(f"{base_url}/jobs/{job_id}/result", timeout=600)
+    result.raise_for_status()
+    finished = time.perf_counter()
+    stages = dict(session.get(f"{base_url}/jobs/{job_id}", timeout=60).json()["timings"])
+    stages["transfer"] = finished - transfer_started
+    return {"latency": finished - started, "bytes": len(result.content), "stages": stages}
+
+
+def scrape_histograms(session, base_url):
+    """读取 /metrics 中各直方图（按标签区分）的 _sum 与 _count。"""
+    totals = {}
+    for line in session.get(f"{base_url}/metrics", timeout=60).text.splitlines():
+        if line.startswith("#") or not line.strip():
+            continue
+        name_labels, _, value = line.rpartition(" ")
+        name, brace, labels = name_labels.partition("{")
+        for suffix in ("_sum", "_count"):
+            if name.endswith(suffix):
+                # 保留标签，例如 motion_job_stage_seconds{stage="queued"}
+                metric = name[:-len(suffix)] + brace + labels
+                entry = totals.setdefault(metric, {"sum": 0.0, "count": 0})
+                entry[suffix[1:]] += float(value)
+    return totals
+
+
+def diff_histograms(before, after):
+    stages = {}
+    for metric, entry in after.items():
+        prev = before.get(metric, {"sum": 0.0, "count": 0})
+        count = entry["count"] - prev["count"]
+        if count > 0:
+            stages[metric] = {"count": int(count), "mean": round((entry["sum"] - prev["sum"]) / count, 4)}
+    return stages
+
+
+def start_server(args, workdir):
+    """在后台线程中启动 uvicorn，模型与翻译服务换成 stub。返回 base_url。"""
+    os.environ[STEP_MS_ENV] = str(args.step_ms)
+    os.environ[BATCH_COST_ENV] = str(args.batch_cost)
+    os.environ[RENDER_MS_ENV] = str(args.render_ms)
+    os.environ[VIDEO_KB_ENV] = str(args.video_kb)
+    os.chdir(workdir)
+
+    cfg = SimpleNamespace(GENERAL=SimpleNamespace(CHECKPOINT=os.path.join(workdir, "checkpoints"), EXP_NAME="bench"))
+    replicas = [api.LitGenModel(StubInterGen(steps=args.steps), cfg) for _ in range(args.replicas)]
+    api.translate_client = StubTranslateClient(args.translate_ms)
+    api.translation_cache = api.TranslationCache(db_path="")
+    # 服务端的启动日志打到 stderr，标准输出只留 JSON 报告
+    with contextlib.redirect_stdout(sys.stderr):
+        api.start_pipeline(replicas, model_hash="bench", warmup=True, render_workers=args.render_workers,
+                           cache_dir=os.path.join(workdir, "cache"),
+                           cache_max_bytes=0 if args.no_cache else api.RESULT_CACHE_MAX_BYTES)
+    # 模型已由上面装好，不再执行真实的启动钩子
+    api.app.router.on_startup.clear()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-server", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="motion-bench-")
+    base_url, server = start_server(args, workdir)
+    workload = build_workload(args)
+    run_one = run_job_request if args.mode == "jobs" else run_sync_request
+    local = threading.local()
+
+    def task(item):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        try:
+            return run_one(local.session, base_url, item)
+        except Exception as e:
+            return {"error": str(e)}
+
+    with requests.Session() as session:
+        before = scrape_histograms(session, base_url)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(task, workload))
+        wall = time.perf_counter() - started
+        server_stages = diff_histograms(before, scrape_histograms(session, base_url))
+        stats = session.get(f"{base_url}/stats", timeout=60).json()
+    server.should_exit = True
+
+    ok = [r for r in results if "error" not in r]
+    errors = [r["error"] for r in results if "error" in r]
+    client_stages = {}
+    for r in ok:
+        for stage, seconds in r["stages"].items():
+            client_stages.setdefault(stage, []).append(seconds)
+    return {
+        "config": vars(args),
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(errors),
+        "errors": sorted(set(errors))[:10],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall > 0 else None,
+        "latency": summarize([r["latency"] for r in ok]),
+        "job_stages": {stage: summarize(values) for stage, values in client_stages.items()},
+        "server_stages": server_stages,
+        "server_stats": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用 CPU stub 模型压测 api_1_1.py，结果以 JSON 输出")
+    parser.add_argument("--mode", choices=("jobs", "sync"), default="jobs",
+                        help="jobs: POST /jobs + 事件流 + 下载结果；sync: POST /generate_motion")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--unique", type=int, default=0, help="不同 prompt 的数量，0 表示每个请求都不同")
+    parser.add_argument("--translate-ratio", type=float, default=0.0, help="需要服务端翻译的请求比例")
+    parser.add_argument("--formats", default="mp4", help='输出格式及权重，如 "mp4:0.7,npz:0.3"')
+    parser.add_argument("--prompts-file", help="每行一个 prompt，替代自动生成的 prompt")
+    parser.add_argument("--replicas", type=int, default=1, help="CPU stub 模型副本数")
+    parser.add_argument("--steps", type=int, default=50, help="stub 扩散步数")
+    parser.add_argument("--step-ms", type=float, default=20, help="单样本每个扩散步的耗时")
+    parser.add_argument("--batch-cost", type=float, default=0.1, help="batch 中每多一个样本增加的相对耗时")
+    parser.add_argument("--render-ms", type=float, default=500, help="stub 渲染每个视频的耗时")
+    parser.add_argument("--renderer", choices=("matplotlib", "native"), default="matplotlib",
+                        help="matplotlib 使用 stub 渲染；native 使用真实的原生渲染（需要 ffmpeg）")
+    parser.add_argument("--render-workers", type=int, default=api.RENDER_WORKERS)
+    parser.add_argument("--video-kb", type=float, default=256, help="stub 视频文件大小")
+    parser.add_argument("--translate-ms", type=float, default=300, help="假翻译服务的延迟")
+    parser.add_argument("--no-cache", action="store_true", help="关闭结果缓存")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="把 JSON 结果写入文件，默认打印到标准输出")
+    args = parser.parse_args()
+
+    report = json.dumps(run_benchmark(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,28 @@
 import sys
 import os
 import time
+import csv
+import random
+import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests  # 新增：用于调用接口
+from urllib3.exceptions import HTTPError as Urllib3Error
+from urllib3.util.retry import Retry
 from datetime import datetime
+from functools import partial
 
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer, QObject, QRunnable, QThreadPool, QUrl
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QTextEdit,
     QPushButton, QSpinBox, QFileDialog, QHBoxLayout,
     QVBoxLayout, QGroupBox, QFormLayout, QCheckBox,
     QListWidget, QListWidgetItem, QProgressBar, QMessageBox,
-    QLineEdit, QStyle, QProxyStyle, QLabel
+    QLineEdit, QStyle, QProxyStyle, QLabel, QComboBox
 )
-from PyQt5.QtGui import QPalette, QColor, QFont, QPainter, QPen, QBrush, QLinearGradient
+from PyQt5.QtGui import QPalette, QColor, QFont, QPainter, QPen, QBrush, QLinearGradient, QDesktopServices
 import math  # 动态背景：用于计算渐变的平滑变化
 
 
@@ -146,6 +156,10 @@ def build_common_qss() -> str:
     }
 
     QTextEdit#LogText,
+    QWidget#JobRow {
+        background-color: transparent;
+    }
+
     QListWidget#HistoryList {
         background-color: rgba(33, 35, 52, 240);
         border-radius: 14px;
@@ -242,9 +256,276 @@ API_URL = "http://127.0.0.1:8000/generate_motion"
 # 也不需要加载 heavy model checkponts
 # -----------------------------------------------
 
-def call_api_generate(prompt: str, output_dir: str, log_callback=None) -> str:
+API_BASE = API_URL.rsplit('/', 1)[0]
+# 等待任务完成的整体超时（秒）
+JOB_TIMEOUT = 300
+# 客户端同时进行的任务数上限（界面上可在 1~MAX_CONCURRENT_JOBS 之间调整）
+DEFAULT_CONCURRENT_JOBS = 2
+MAX_CONCURRENT_JOBS = 16
+
+# HTTP 超时（秒）：建连超时与单次读取超时，与等待任务完成的整体超时 JOB_TIMEOUT 分开
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 60
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+# 连接失败与 503 的重试次数及指数退避系数（第 n 次重试前等待 backoff * 2^(n-1) 秒）
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+
+
+def create_http_session() -> requests.Session:
+    """创建带连接池与重试策略的 HTTP 会话。
+
+    - 连接池大小覆盖最大并发数，keep-alive 复用连接，省去每次请求的握手
+    - 建连失败与 503（服务端未就绪/过载）按指数退避重试；已发出的请求读取失败不重试，避免重复提交任务
+    """
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=0,
+        status=HTTP_MAX_RETRIES,
+        status_forcelist=(503,),
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_JOBS,
+                                            max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# 所有 API 调用共享的 HTTP 会话（每个进程一个）
+HTTP_SESSION = create_http_session()
+
+# 任务阶段 -> 进度条百分比；running 阶段按扩散步在 30~70 之间推进，下载在 90~100 之间推进
+JOB_STATUS_PROGRESS = {
+    "translating": 5,
+    "queued": 10,
+    "running": 30,
+    "rendering": 75,
+    "done": 90,
+}
+
+
+def iter_sse_events(response):
+    """解析 text/event-stream 响应，逐个产出事件的 data（JSON）；收到心跳时产出 None。
+
+    任务排队或卡住时服务端只发心跳，调用方借此在没有新事件时也能检查超时与停止请求。
+    """
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield json.loads("\n".join(data_lines))
+                data_lines = []
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif line.startswith(":"):
+            yield None
+        # event: 行无需处理（event 名称也包含在 data 中）
+
+
+def event_progress(event: dict):
+    """把服务端进度事件换算为进度条百分比，无法换算时返回 None。"""
+    kind = event.get("event")
+    if kind == "status":
+        return JOB_STATUS_PROGRESS.get(event.get("status"))
+    if kind == "diffusion_step" and event.get("total"):
+        return 30 + int(40 * min(event["step"], event["total"]) / event["total"])
+    if kind == "postprocessed":
+        return 72
+    return None
+
+
+# 输出格式 -> 本地文件扩展名（mp4 为视频，其余为关节数据）
+OUTPUT_FORMAT_EXT = {
+    "mp4": "mp4",
+    "npz": "npz",
+    "npy-stream": "npy",
+    "json": "json",
+}
+
+
+class CancelToken:
+    """在线程间传递取消请求：取消时立即关闭正在进行的 HTTP 响应，并由请求线程通知服务端。"""
+
+    def __init__(self):
+        self._cancelled = False
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def attach(self, response):
+        """登记当前正在读取的响应；已取消时立即关闭。"""
+        with self._lock:
+            self._response = response
+            cancelled = self._cancelled
+        if cancelled:
+            response.close()
+
+
+def cancel_job(job_id: str, log_callback=None):
+    """通知服务端取消任务，释放其推理/渲染队列位置（尽力而为，失败不抛异常）。"""
+    try:
+        response = HTTP_SESSION.post(f"{API_BASE}/jobs/{job_id}/cancel", timeout=(HTTP_CONNECT_TIMEOUT, 10))
+        if log_callback:
+            log_callback(f"已通知服务端取消任务 {job_id} ({response.status_code})")
+    except requests.exceptions.RequestException as e:
+        if log_callback:
+            log_callback(f"通知服务端取消任务失败: {e}")
+
+
+# 下载分块大小（字节）：按实测吞吐自适应，使每块读取约 DOWNLOAD_TARGET_CHUNK_SECONDS 秒
+DOWNLOAD_MIN_CHUNK = 64 * 1024
+DOWNLOAD_MAX_CHUNK = 4 * 1024 * 1024
+DOWNLOAD_TARGET_CHUNK_SECONDS = 0.25
+
+
+class DownloadError(Exception):
+    pass
+
+
+def download_file(url: str, save_path: str, progress_callback=None, log_callback=None,
+                  cancel_token: "CancelToken" = None) -> str:
+    """断点续传地下载结果文件并校验 sha256。
+
+    先写入 save_path + ".part"，连接中断时用 Range/If-Range 从已下载的位置继续，
+    全部收到后与服务端给出的 X-Content-SHA256 比对，一致才原子地重命名为 save_path。
+    progress_callback(received, total) 汇报字节进度。返回文件的 sha256。
+    """
+    part_path = save_path + ".part"
+    digest = hashlib.sha256()
+    received = 0
+    total = None
+    etag = None
+    expected_sha = None
+    chunk_size = DOWNLOAD_MIN_CHUNK
+    failures = 0
+
+    def _log(msg: str):
+        if log_callback:
+            log_callback(msg)
+
+    try:
+        with open(part_path, "wb") as f:
+            while total is None or received < total:
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise RuntimeError("用户取消")
+                headers = {}
+                if received and etag:
+                    headers = {"Range": f"bytes={received}-", "If-Range": etag}
+                try:
+                    response = HTTP_SESSION.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT)
+                    if cancel_token is not None:
+                        cancel_token.attach(response)
+                    if response.status_code == 200 and received:
+                        # 服务端不支持续传或文件已变化，从头开始
+                        _log("服务端返回完整文件，重新下载")
+                        f.seek(0)
+                        f.truncate()
+                        digest = hashlib.sha256()
+                        received = 0
+                    elif response.status_code not in (200, 206):
+                        raise DownloadError(f"下载失败 ({response.status_code}): {response.text[:200]}")
+                    etag = response.headers.get("ETag", etag)
+                    expected_sha = response.headers.get("X-Content-SHA256", expected_sha)
+                    if response.status_code == 206:
+                        total = int(response.headers["Content-Range"].rsplit("/", 1)[1])
+                    else:
+                        total = int(response.headers.get("Content-Length") or 0) or None
+
+                    with response:
+                        while True:
+                            chunk_start = time.time()
+                            chunk = response.raw.read(chunk_size, decode_content=True)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            digest.update(chunk)
+                            received += len(chunk)
+                            if progress_callback:
+                                progress_callback(received, total)
+                            if cancel_token is not None and cancel_token.cancelled:
+                                raise RuntimeError("用户取消")
+                            # 按本块的吞吐调整下一块大小
+                            elapsed = max(time.time() - chunk_start, 1e-3)
+                            chunk_size = int(min(DOWNLOAD_MAX_CHUNK,
+                                                 max(DOWNLOAD_MIN_CHUNK,
+                                                     len(chunk) / elapsed * DOWNLOAD_TARGET_CHUNK_SECONDS)))
+                    if total is None:
+                        break
+                    if received < total:
+                        raise requests.exceptions.ChunkedEncodingError(f"连接提前关闭 ({received}/{total})")
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout, Urllib3Error) as e:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        raise RuntimeError("用户取消")
+                    failures += 1
+                    if failures > HTTP_MAX_RETRIES or not etag:
+                        raise
+                    delay = HTTP_BACKOFF_FACTOR * (2 ** (failures - 1))
+                    _log(f"下载中断 ({e})，{delay:.1f}s 后从 {received} 字节处续传...")
+                    time.sleep(delay)
+
+        actual_sha = digest.hexdigest()
+        if expected_sha and actual_sha != expected_sha:
+            raise DownloadError(f"文件校验失败：期望 {expected_sha}，实际 {actual_sha}")
+        os.replace(part_path, save_path)
+        return actual_sha
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def safe_filename(prompt: str) -> str:
+    safe_prompt = "".join(c if c.isalnum() or c in " _-" else "_" for c in prompt)
+    return safe_prompt.strip().replace(" ", "_")[:40] or "motion"
+
+
+def call_api_generate(prompt: str, output_dir: str, log_callback=None,
+                      progress_callback=None, cancel_token: CancelToken = None,
+                      output_format: str = "mp4", translate: bool = False,
+                      target_lang: str = "English", filename: str = None,
+                      renderer: str = "matplotlib", stream: bool = False,
+                      stream_callback=None, num_frames: int = None, seed: int = None,
+                      preview: bool = False, job_info: dict = None) -> str:
     """
-    调用 FastAPI 接口生成视频，并保存到本地。
+    调用 FastAPI 任务接口生成视频（或关节数据），并保存到本地。
+
+    流程：POST /jobs 提交任务 -> 订阅 GET /jobs/{id}/events 进度 -> GET /jobs/{id}/result 下载。
+    progress_callback(int): 按任务阶段汇报进度。
+    cancel_token: 取消时中断当前传输，并调用 POST /jobs/{id}/cancel 让服务端丢弃该任务。
+    output_format: mp4 / npz / npy-stream / json，非 mp4 时服务端跳过渲染。
+    translate: 为 True 时由服务端先翻译为 target_lang 再生成，无需单独请求 /translate。
+    filename: 可选的本地文件名（不含扩展名），默认由 prompt 与时间戳生成。
+    renderer: mp4 的渲染器，matplotlib（标准）或 native（快速）。
+    stream: 为 True 时服务端输出分片 MP4，渲染一开始即调用 stream_callback(url)，
+        url 可直接交给播放器边下边播；完整文件仍照常下载保存。
+    num_frames: 生成帧数（30 fps），为空时使用服务端默认的 210 帧。
+    seed: 随机种子，指定后同一 prompt 的结果可复现；为空时使用服务端默认的噪声，结果按 prompt 缓存，
+        同一 prompt 总是得到同一个结果。
+    preview: 快速预览（更少的采样步数、低分辨率视频），服务端选定的 seed 写入 job_info["seed"]，
+        之后以该 seed 且 preview=False 请求即得到完整质量版本。
+    job_info: 可选的 dict，提交成功后写入服务端返回的任务信息。
     """
     def _log(msg: str):
         if log_callback:
@@ -252,131 +533,411 @@ def call_api_generate(prompt: str, output_dir: str, log_callback=None) -> str:
         else:
             print(msg)
 
-    _log(f"正在连接服务器: {API_URL} ...")
+    def _progress(value: int):
+        if progress_callback:
+            progress_callback(value)
+
+    def _check_stop():
+        if cancel_token is not None and cancel_token.cancelled:
+            raise RuntimeError("用户取消")
+
+    def _track(response):
+        if cancel_token is not None:
+            cancel_token.attach(response)
+        return response
+
+    def _raise_for_error(response):
+        error_detail = "Unknown Error"
+        try:
+            error_detail = response.json().get("detail", response.text)
+        except:
+            error_detail = response.text
+        raise Exception(f"Server Error ({response.status_code}): {error_detail}")
+
+    _log(f"正在连接服务器: {API_BASE} ...")
 
     # 1. 准备请求数据
-    # 注意：根据你之前的 FastAPI 代码，接口只接受 {"text": "..."}
-    # 如果后续服务端更新支持了 num_frames 或 seed，可以在这里添加到 payload 中
     payload = {
-        "text": prompt
+        "text": prompt,
+        "format": output_format,
+        "translate": translate,
+        "target_lang": target_lang,
+        "renderer": renderer,
+        "stream": stream,
+        "preview": preview,
     }
+    if num_frames is not None:
+        payload["num_frames"] = num_frames
+    if seed is not None:
+        payload["seed"] = seed
 
+    job_id = None
     try:
-        # 2. 发送请求 (设置超时时间，因为生成视频可能较慢)
-        # stream=True 允许我们分块下载大文件（虽然这里视频不大，但好习惯）
         start_time = time.time()
-        response = requests.post(API_URL, json=payload, stream=True, timeout=300)
-        
-        if response.status_code == 200:
-            _log("服务器处理成功，正在下载视频...")
-            
-            # 3. 构造保存路径
-            os.makedirs(output_dir, exist_ok=True)
-            safe_prompt = "".join(c if c.isalnum() or c in " _-" else "_" for c in prompt)
-            safe_prompt = safe_prompt.strip().replace(" ", "_")[:40] or "motion"
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{safe_prompt}_{timestamp}.mp4"
-            save_path = os.path.join(output_dir, filename)
-
-            # 4. 写入文件
-            with open(save_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            elapsed = time.time() - start_time
-            _log(f"下载完成！耗时: {elapsed:.2f}s")
-            return save_path
+
+        # 2. 提交任务，服务端立即返回任务 ID
+        response = HTTP_SESSION.post(f"{API_BASE}/jobs", json=payload, timeout=HTTP_TIMEOUT)
+        if response.status_code != 200:
+            _raise_for_error(response)
+        job = response.json()
+        job_id = job["id"]
+        if job_info is not None:
+            job_info.update(job)
+        if job.get("seed") is not None:
+            _log(f"任务已提交: {job_id} (seed {job['seed']})")
         else:
-            # 处理服务器错误信息
-            error_detail = "Unknown Error"
+            _log(f"任务已提交: {job_id}")
+
+        # 3. 订阅任务进度事件流，进度条由服务端真实阶段驱动；断线后从上次的事件序号续订
+        last_value = 0
+        next_seq = 0
+        reconnects = 0
+        finished = False
+        while not finished:
+            _check_stop()
+            response = _track(HTTP_SESSION.get(f"{API_BASE}/jobs/{job_id}/events", params={"since": next_seq},
+                                               stream=True, timeout=HTTP_TIMEOUT))
+            if response.status_code != 200:
+                _raise_for_error(response)
             try:
-                error_detail = response.json().get("detail", response.text)
-            except:
-                error_detail = response.text
-            raise Exception(f"Server Error ({response.status_code}): {error_detail}")
+                for event in iter_sse_events(response):
+                    _check_stop()
+                    if time.time() - start_time > JOB_TIMEOUT:
+                        raise Exception(f"等待任务超时 ({JOB_TIMEOUT}s): {job_id}")
+                    if event is None:
+                        continue
+                    next_seq = event["seq"] + 1
+                    kind = event.get("event")
+                    if kind == "status":
+                        _log(f"任务状态: {event['status']} (上一阶段耗时 {event.get('elapsed', 0):.2f}s)")
+                    elif kind == "queue_position":
+                        _log(f"排队中，前面还有 {event['position']} 个任务")
+                    elif kind == "translated":
+                        if event.get("skipped"):
+                            _log("Prompt 已是目标语言，跳过翻译")
+                        else:
+                            _log(f"翻译完成: {event['prompt']}")
+                    elif kind == "render_started":
+                        _log(f"开始渲染视频 ({event.get('frames')} 帧)...")
+                        if event.get("stream") and stream_callback:
+                            stream_callback(f"{API_BASE}/jobs/{job_id}/stream")
+                    value = event_progress(event)
+                    if value is not None and value > last_value:
+                        _progress(value)
+                        last_value = value
+                    if kind == "status" and event["status"] == "failed":
+                        raise Exception(f"服务端生成失败: {event.get('error')}")
+                    if kind == "status" and event["status"] == "cancelled":
+                        raise Exception(f"任务已在服务端被取消: {job_id}")
+                    if kind == "status" and event["status"] == "done":
+                        finished = True
+                        break
+                else:
+                    raise requests.exceptions.ConnectionError("事件流意外中断")
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                _check_stop()
+                reconnects += 1
+                if reconnects > HTTP_MAX_RETRIES:
+                    raise
+                delay = HTTP_BACKOFF_FACTOR * (2 ** (reconnects - 1))
+                _log(f"事件流断开 ({e})，{delay:.1f}s 后重连（任务 {job_id} 在服务端继续执行）...")
+                time.sleep(delay)
+            finally:
+                response.close()
+
+        _log("服务器处理成功，正在下载结果...")
+
+        # 4. 构造保存路径
+        os.makedirs(output_dir, exist_ok=True)
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"{safe_filename(prompt)}_{timestamp}"
+        save_path = os.path.join(output_dir, f"{filename}.{OUTPUT_FORMAT_EXT.get(output_format, 'bin')}")
+
+        # 5. 下载结果：断线后按 Range 续传，校验 sha256 后才落盘为最终文件
+        #    （任务结果在服务端保留一段时间，无需重新推理）
+        _check_stop()
+
+        def _download_progress(received: int, total: int):
+            if total:
+                _progress(90 + int(10 * received / total))
+
+        sha256 = download_file(f"{API_BASE}/jobs/{job_id}/result", save_path,
+                               progress_callback=_download_progress, log_callback=_log,
+                               cancel_token=cancel_token)
+        _log(f"文件校验通过 (sha256 {sha256[:12]}...)")
+
+        elapsed = time.time() - start_time
+        _progress(100)
+        _log(f"下载完成！耗时: {elapsed:.2f}s")
+        return save_path
 
-    except requests.exceptions.ConnectionError:
-        raise Exception(f"无法连接到服务器。请确认服务器已启动且地址正确: {API_URL}")
     except Exception as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            # 传输已被中断（关闭响应会让读取抛出异常），再通知服务端丢弃任务
+            if job_id:
+                cancel_job(job_id, log_callback=_log)
+            raise RuntimeError("用户取消") from None
+        if isinstance(e, requests.exceptions.ConnectionError):
+            raise Exception(f"无法连接到服务器。请确认服务器已启动且地址正确: {API_BASE}")
         raise e
 
 
+# --------- 批量生成 ---------
+
+def load_prompt_file(path: str) -> list:
+    """读取批量 prompt 文件：.txt 每行一条（# 开头为注释），.csv 取 prompt/text 列或第一列，
+    .jsonl 每行一个对象（prompt/text 字段）或字符串。"""
+    prompts = []
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if ext == ".csv":
+            rows = list(csv.reader(f))
+            if rows:
+                header = [h.strip().lower() for h in rows[0]]
+                column = next((header.index(k) for k in ("prompt", "text") if k in header), None)
+                if column is None:
+                    column = 0
+                else:
+                    rows = rows[1:]
+                prompts = [row[column] for row in rows if len(row) > column]
+        elif ext == ".jsonl":
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                prompts.append(record if isinstance(record, str) else record.get("prompt") or record.get("text") or "")
+        else:
+            prompts = [line for line in f if not line.lstrip().startswith("#")]
+    return [p.strip() for p in prompts if p and p.strip()]
+
+
+def dedupe_prompts(prompts: list) -> list:
+    """去掉重复 prompt（忽略大小写与多余空白），保持原有顺序。"""
+    seen = set()
+    unique = []
+    for prompt in prompts:
+        key = " ".join(prompt.lower().split())
+        if key not in seen:
+            seen.add(key)
+            unique.append(prompt)
+    return unique
+
+
+class BatchManifest:
+    """批量任务清单（JSON Lines），每完成一条追加一行，中断后据此跳过已完成的 prompt。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 中断时可能留下半行
+                    if record.get("status") == "ok" and os.path.exists(record.get("path", "")):
+                        self.completed[record["prompt"]] = record
+
+    def is_done(self, prompt: str) -> bool:
+        return prompt in self.completed
+
+    def record(self, prompt: str, status: str, path: str = None, latency: float = None, error: str = None):
+        record = {"prompt": prompt, "status": status, "path": path,
+                  "latency": round(latency, 3) if latency is not None else None, "error": error,
+                  "time": datetime.now().isoformat(timespec="seconds")}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if status == "ok":
+                self.completed[prompt] = record
+        return record
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_batch(prompts: list, output_dir: str, concurrency: int = DEFAULT_CONCURRENT_JOBS,
+              output_format: str = "mp4", translate: bool = True, target_lang: str = "English",
+              renderer: str = "matplotlib", num_frames: int = None, seed: int = None,
+              log_callback=print) -> dict:
+    """无界面批量生成：去重、限制并发、按清单断点续跑，结束后写出 summary.json。"""
+    if not 1 <= concurrency <= MAX_CONCURRENT_JOBS:
+        # HTTP_SESSION 的连接池按 MAX_CONCURRENT_JOBS 分配，超出的连接用完即丢，无法 keep-alive 复用
+        clamped = max(1, min(concurrency, MAX_CONCURRENT_JOBS))
+        log_callback(f"并发数 {concurrency} 超出范围，改为 {clamped}")
+        concurrency = clamped
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BatchManifest(os.path.join(output_dir, "manifest.jsonl"))
+    unique = dedupe_prompts(prompts)
+    pending = [(i, p) for i, p in enumerate(unique) if not manifest.is_done(p)]
+    log_callback(f"共 {len(prompts)} 条 prompt，去重后 {len(unique)} 条，"
+                 f"已完成 {len(unique) - len(pending)} 条，待生成 {len(pending)} 条")
+
+    def _generate(index: int, prompt: str):
+        start = time.time()
+        try:
+            path = call_api_generate(
+                prompt, output_dir,
+                log_callback=lambda msg: log_callback(f"[{index}] {msg}"),
+                output_format=output_format,
+                translate=translate,
+                target_lang=target_lang,
+                filename=f"{index:05d}_{safe_filename(prompt)}",
+                renderer=renderer,
+                num_frames=num_frames,
+                seed=seed
+            )
+            return manifest.record(prompt, "ok", path=path, latency=time.time() - start)
+        except Exception as e:
+            return manifest.record(prompt, "failed", latency=time.time() - start, error=str(e))
+
+    batch_start = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(_generate, i, p) for i, p in pending]
+        for done_count, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            results.append(record)
+            log_callback(f"进度 {done_count}/{len(pending)}: [{record['status']}] {record['prompt'][:40]}")
+    wall_time = time.time() - batch_start
+
+    summary = write_batch_summary(output_dir, len(prompts), len(unique), len(unique) - len(pending),
+                                  results, wall_time)
+    log_callback(f"批量生成结束：成功 {summary['succeeded']}，失败 {summary['failed']}，"
+                 f"跳过 {summary['skipped']}，总耗时 {wall_time:.1f}s")
+    return summary
+
+
+def write_batch_summary(output_dir: str, total: int, unique: int, skipped: int, results: list,
+                        wall_time: float) -> dict:
+    """汇总一批结果（成功数、失败数、耗时分位数）并写出 output_dir/summary.json。"""
+    latencies = [r["latency"] for r in results if r["status"] == "ok"]
+    summary = {
+        "total": total,
+        "unique": unique,
+        "skipped": skipped,
+        "succeeded": len(latencies),
+        "failed": len(results) - len(latencies),
+        "wall_time": round(wall_time, 3),
+        "throughput_per_min": round(len(latencies) / wall_time * 60, 3) if wall_time > 0 else None,
+        "latency": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies) if latencies else None,
+        },
+        "items": results,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
 # --------- PyQt5 界面部分 (保留你的逻辑，修改 Worker) ---------
 
-class GenerationWorker(QThread):
-    """在子线程中调用 API，避免卡死界面。"""
+class GenerationSignals(QObject):
+    """QRunnable 不是 QObject，信号放在单独的对象上。"""
     progress_changed = pyqtSignal(int)
     log_message = pyqtSignal(str)
     finished_ok = pyqtSignal(str, dict)
     error = pyqtSignal(str)
+    finished = pyqtSignal()
+    # 流式任务开始渲染，参数为可边下边播的视频地址
+    stream_ready = pyqtSignal(str)
 
-    def __init__(self, prompt: str, params: dict, parent=None):
-        super().__init__(parent)
+
+class GenerationWorker(QRunnable):
+    """在线程池中调用 API，避免卡死界面；多个任务共享 HTTP_SESSION 并发执行。"""
+
+    def __init__(self, prompt: str, params: dict):
+        super().__init__()
+        self.setAutoDelete(False)
         self.prompt = prompt
         self.params = params
+        self.signals = GenerationSignals()
+        self.progress_changed = self.signals.progress_changed
+        self.log_message = self.signals.log_message
+        self.finished_ok = self.signals.finished_ok
+        self.error = self.signals.error
+        self.finished = self.signals.finished
+        self.stream_ready = self.signals.stream_ready
         self._is_interrupted = False
+        self._cancel_token = CancelToken()
 
     def run(self):
+        try:
+            self._run()
+        finally:
+            self.finished.emit()
+
+    def _run(self):
         try:
             def log_cb(msg: str):
                 self.log_message.emit(msg)
 
             self.log_message.emit(">>> 开始请求远程生成...")
-            self.progress_changed.emit(10) # 模拟进度
+            self.progress_changed.emit(0)
 
             # 调用 API 函数
             output_dir = self.params.get("output_dir")
 
-            # 注意：API请求通常是阻塞的，很难获得精确的“生成进度百分比”。
-            # 我们只能模拟一个“等待中”的状态。
-            self.progress_changed.emit(30)
-
             if self._is_interrupted: raise RuntimeError("用户取消")
 
-            # 支持先调用翻译接口将 prompt 翻译为目标语言（默认英语）
+            # 支持由服务端先将 prompt 翻译为目标语言（默认英语），翻译与生成在同一个任务中完成
             translate_flag = self.params.get("translate", False)
             target_lang = self.params.get("target_lang", "English")
-            prompt_to_send = self.prompt
 
+            # 已经是目标语言的 prompt 由服务端判断并跳过翻译
             if translate_flag:
-                try:
-                    self.log_message.emit(">>> 请求翻译服务，将 prompt 翻译为目标语言...")
-                    base = API_URL.rsplit('/', 1)[0]
-                    translate_url = f"{base}/translate"
-                    tr_resp = requests.post(translate_url, json={"text": self.prompt, "target_lang": target_lang}, timeout=30)
-                    if tr_resp.status_code == 200:
-                        tr_json = tr_resp.json()
-                        translated = tr_json.get("translation") or tr_json.get("translated")
-                        if translated:
-                            prompt_to_send = translated
-                            self.log_message.emit(f">>> 翻译完成: {translated}")
-                        else:
-                            raise RuntimeError("翻译响应格式不包含 translation 字段")
-                    else:
-                        raise RuntimeError(f"翻译服务错误 ({tr_resp.status_code}): {tr_resp.text}")
-                except Exception as e:
-                    self.error.emit(f"翻译失败: {e}")
-                    return
+                self.log_message.emit(f">>> 服务端将先把 prompt 翻译为 {target_lang} 再生成")
 
             # --- 核心修改：调用 API 而不是本地模型 ---
+            # 进度由服务端任务状态驱动，而不是模拟值
+            job_info = {}
             output_path = call_api_generate(
-                prompt_to_send,
+                self.prompt,
                 output_dir,
-                log_callback=log_cb
+                log_callback=log_cb,
+                progress_callback=self.progress_changed.emit,
+                cancel_token=self._cancel_token,
+                output_format=self.params.get("output_format", "mp4"),
+                translate=translate_flag,
+                target_lang=target_lang,
+                filename=self.params.get("filename"),
+                renderer=self.params.get("renderer", "matplotlib"),
+                stream=self.params.get("stream", False),
+                stream_callback=self.stream_ready.emit,
+                num_frames=self.params.get("num_frames"),
+                seed=self.params.get("seed"),
+                preview=self.params.get("preview", False),
+                job_info=job_info
             )
             # -------------------------------------
 
             if self._is_interrupted:
-                self.error.emit("生成已被用户中断")
+                self.error.emit("用户取消")
             else:
                 self.progress_changed.emit(100)
-                self.finished_ok.emit(output_path, self.params)
+                # 带上服务端实际使用的 seed（预览时由服务端选定）
+                self.finished_ok.emit(output_path, dict(self.params, seed=job_info.get("seed", self.params.get("seed"))))
 
         except Exception as e:
             self.error.emit(str(e))
 
     def stop(self):
+        """中断正在进行的传输，并由工作线程通知服务端取消任务。"""
         self._is_interrupted = True
+        self._cancel_token.cancel()
 
 class CheckBoxBorderStyle(QProxyStyle):
     """保留你的样式类"""
@@ -418,13 +979,46 @@ class AnimatedBackgroundWidget(QWidget):
 
 
 
+class JobRowWidget(QWidget):
+    """生成历史中的一行：任务描述、独立进度条与取消按钮。"""
+
+    def __init__(self, title: str, parent=None):
+        super().__init__(parent)
+        self.setObjectName("JobRow")
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(4, 2, 4, 2)
+        layout.setSpacing(6)
+        self.title_label = QLabel(title)
+        layout.addWidget(self.title_label, 1)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setFixedWidth(120)
+        self.progress_bar.setFixedHeight(18)
+        layout.addWidget(self.progress_bar)
+        self.cancel_btn = QPushButton("取消")
+        layout.addWidget(self.cancel_btn)
+
+    def set_finished(self, text: str):
+        self.title_label.setText(text)
+        self.progress_bar.setValue(100)
+        self.cancel_btn.hide()
+
+    def set_failed(self, text: str):
+        self.title_label.setText(text)
+        self.cancel_btn.hide()
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle(" 智 创 帧 生 ") # 改个标题
         self.resize(1100, 700)
 
-        self.worker = None
+        # 客户端任务队列：task_id -> {"worker", "item", "row", "progress", "prompt"}
+        self.tasks = {}
+        self._next_task_id = 1
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(DEFAULT_CONCURRENT_JOBS)
         self._init_ui()
 
     def _init_ui(self):
@@ -475,27 +1069,54 @@ class MainWindow(QMainWindow):
         left_layout.addWidget(params_group)
         form = QFormLayout(params_group)
 
-        # 注意：因为目前的服务器端代码只接收 'text'，
-        # 这里的 '帧数' 和 '种子' 暂时无法生效，除非更新服务器代码。
-        # 我保留界面，但添加提示。
-        
+        # 帧数范围与服务端 MIN_WINDOW_SIZE / MAX_WINDOW_SIZE 默认值一致；帧数越少推理越快
         self.frames_spin = QSpinBox()
-        self.frames_spin.setRange(10, 2000)
+        self.frames_spin.setRange(16, 300)
         self.frames_spin.setValue(210)
-        self.frames_spin.setEnabled(False) # 暂时禁用，因为服务端是固定的
-        self.frames_spin.setToolTip("当前服务端版本使用固定帧数")
-        form.addRow("帧数 (服务端固定)：", self.frames_spin)
+        self.frames_spin.setToolTip("生成帧数（30 fps），短片段适合快速预览")
+        form.addRow("帧数：", self.frames_spin)
 
         seed_layout = QHBoxLayout()
         self.seed_spin = QSpinBox()
-        self.seed_spin.setEnabled(False) # 暂时禁用
+        self.seed_spin.setRange(0, 2 ** 31 - 1)
+        self.seed_spin.setToolTip("固定种子后同一 prompt 的结果可复现")
+        self.seed_spin.setEnabled(False)
         self.random_seed_checkbox = QCheckBox("随机种子")
         self.random_seed_checkbox.setChecked(True)
-        self.random_seed_checkbox.setEnabled(False) # 暂时禁用
+        self.random_seed_checkbox.setToolTip("每次生成时抽取新的种子并显示在左侧，取消勾选即可复现")
         self.random_seed_checkbox.setStyle(CheckBoxBorderStyle(self.random_seed_checkbox.style()))
+        self.random_seed_checkbox.toggled.connect(lambda checked: self.seed_spin.setEnabled(not checked))
         seed_layout.addWidget(self.seed_spin)
         seed_layout.addWidget(self.random_seed_checkbox)
-        form.addRow("随机种子 (服务端控制)：", seed_layout)
+        form.addRow("随机种子：", seed_layout)
+
+        # 输出格式：只需要关节数据时可跳过服务端渲染
+        self.format_combo = QComboBox()
+        self.format_combo.addItem("MP4 视频", "mp4")
+        self.format_combo.addItem("关节数据 NPZ", "npz")
+        self.format_combo.addItem("关节数据 NPY", "npy-stream")
+        self.format_combo.addItem("关节数据 JSON", "json")
+        form.addRow("输出格式：", self.format_combo)
+
+        # 视频渲染器：快速渲染不经过 matplotlib，速度快一个数量级
+        self.renderer_combo = QComboBox()
+        self.renderer_combo.addItem("标准 (matplotlib)", "matplotlib")
+        self.renderer_combo.addItem("快速 (原生)", "native")
+        form.addRow("渲染器：", self.renderer_combo)
+
+        # 流式播放：服务端用快速渲染器边编码边输出，渲染开始后立即用系统播放器打开
+        self.stream_checkbox = QCheckBox("边渲染边播放")
+        self.stream_checkbox.setToolTip("仅对 MP4 有效，使用快速渲染器；不必等整段视频编码完成")
+        self.stream_checkbox.setStyle(CheckBoxBorderStyle(self.stream_checkbox.style()))
+        form.addRow("流式输出：", self.stream_checkbox)
+
+        # 并发任务数
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, MAX_CONCURRENT_JOBS)
+        self.concurrency_spin.setValue(DEFAULT_CONCURRENT_JOBS)
+        self.concurrency_spin.setToolTip("同时提交到服务端的任务数，多出的任务在本地排队")
+        self.concurrency_spin.valueChanged.connect(self.thread_pool.setMaxThreadCount)
+        form.addRow("并发任务数：", self.concurrency_spin)
 
         # 输出目录
         outdir_layout = QHBoxLayout()
@@ -518,11 +1139,21 @@ class MainWindow(QMainWindow):
         self.generate_btn.clicked.connect(self._on_generate_clicked)
         btn_layout.addWidget(self.generate_btn)
 
-        self.stop_btn = QPushButton("停止")
+        self.preview_btn = QPushButton("快速预览")
+        self.preview_btn.setToolTip("更少的采样步数、低分辨率视频，用于快速筛选 prompt；满意后可用同一种子生成完整版本")
+        self.preview_btn.clicked.connect(partial(self._on_generate_clicked, preview=True))
+        btn_layout.addWidget(self.preview_btn)
+
+        self.stop_btn = QPushButton("全部停止")
         self.stop_btn.setEnabled(False)
         self.stop_btn.clicked.connect(self._on_stop_clicked)
         btn_layout.addWidget(self.stop_btn)
 
+        import_btn = QPushButton("批量导入")
+        import_btn.setToolTip("从 .txt / .csv / .jsonl 文件导入多条 prompt 批量生成")
+        import_btn.clicked.connect(self._on_import_clicked)
+        btn_layout.addWidget(import_btn)
+
         open_dir_btn = QPushButton("打开文件夹")
         open_dir_btn.clicked.connect(self._open_output_dir)
         btn_layout.addWidget(open_dir_btn)
@@ -565,7 +1196,7 @@ class MainWindow(QMainWindow):
         if dir_path:
             self.output_dir_edit.setText(dir_path)
 
-    def _on_generate_clicked(self):
+    def _on_generate_clicked(self, checked=False, preview=False):
         prompt = self.prompt_edit.toPlainText().strip()
         if not prompt:
             QMessageBox.warning(self, "提示", "请输入文本描述")
@@ -576,37 +1207,121 @@ class MainWindow(QMainWindow):
             output_dir = os.path.join(os.getcwd(), "downloaded_videos")
             self.output_dir_edit.setText(output_dir)
 
-        # 参数收集（虽然部分目前没用，但保留结构）
+        # 参数收集：全部随请求发送给服务端
         params = {
             "output_dir": output_dir,
             # 是否先调用后端翻译接口将 prompt 翻译为英语再生成
             "translate": True,
             "target_lang": "English",
+            "output_format": self.format_combo.currentData(),
+            "renderer": self.renderer_combo.currentData(),
+            "stream": self.stream_checkbox.isChecked(),
+            "num_frames": self.frames_spin.value(),
+            "seed": self._selected_seed(),
+            "preview": preview,
         }
 
-        self._log(">>> 准备请求生成...")
-        self._log(f"Prompt: {prompt}")
+        self._submit_task(prompt, params)
+
+    def _selected_seed(self):
+        """勾选随机种子时在本地抽一个种子并显示在界面上。
+
+        不能发送 None 交给服务端：未指定 seed 的结果按 prompt 缓存，同一 prompt 总是得到同一个结果。
+        """
+        if self.random_seed_checkbox.isChecked():
+            self.seed_spin.setValue(random.randrange(2 ** 31))
+        return self.seed_spin.value()
+
+    def _on_import_clicked(self):
+        path, _ = QFileDialog.getOpenFileName(self, "导入 prompt 文件", "",
+                                              "Prompt 文件 (*.txt *.csv *.jsonl)")
+        if not path:
+            return
+        try:
+            prompts = load_prompt_file(path)
+        except Exception as e:
+            QMessageBox.warning(self, "导入失败", str(e))
+            return
+
+        output_dir = self.output_dir_edit.text().strip() or os.path.join(os.getcwd(), "downloaded_videos")
+        self.output_dir_edit.setText(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        # 与命令行批量模式共用清单，已完成的 prompt 不再重复生成
+        manifest = BatchManifest(os.path.join(output_dir, "manifest.jsonl"))
+        unique = dedupe_prompts(prompts)
+        pending = [(i, p) for i, p in enumerate(unique) if not manifest.is_done(p)]
+        self._log(f">>> 导入 {os.path.basename(path)}：共 {len(prompts)} 条，去重后 {len(unique)} 条，"
+                  f"待生成 {len(pending)} 条")
+        # 这一批的进度，最后一个任务结束时与命令行批量模式一样写出 summary.json
+        batch = {"output_dir": output_dir, "total": len(prompts), "unique": len(unique),
+                 "skipped": len(unique) - len(pending), "remaining": len(pending), "results": [],
+                 "started_at": time.time()}
+        if not pending:
+            self._finish_batch(batch)
+        for index, prompt in pending:
+            params = {
+                "output_dir": output_dir,
+                "translate": True,
+                "target_lang": "English",
+                "output_format": self.format_combo.currentData(),
+                "renderer": self.renderer_combo.currentData(),
+                "num_frames": self.frames_spin.value(),
+                "seed": self._selected_seed(),
+                "filename": f"{index:05d}_{safe_filename(prompt)}",
+                "manifest": manifest,
+                "batch": batch,
+            }
+            self._submit_task(prompt, params)
+
+    def _submit_task(self, prompt: str, params: dict):
+        """创建一个任务行并放入线程池，超出并发数的任务在本地排队。"""
+        task_id = self._next_task_id
+        self._next_task_id += 1
+        self._log(f">>> [#{task_id}] 准备请求生成...")
+        self._log(f"[#{task_id}] Prompt: {prompt}")
+        if params.get("seed") is not None:
+            self._log(f"[#{task_id}] Seed: {params['seed']}")
+
+        row = JobRowWidget(f"#{task_id} 排队中: {prompt[:30]}")
+        item = QListWidgetItem()
+        item.setToolTip(prompt)
+        item.setSizeHint(row.sizeHint())
+        self.result_list.addItem(item)
+        self.result_list.setItemWidget(item, row)
+        self.result_list.scrollToBottom()
+
+        worker = GenerationWorker(prompt, params)
+        worker.progress_changed.connect(partial(self._on_progress_changed, task_id))
+        worker.log_message.connect(lambda msg, task_id=task_id: self._log(f"[#{task_id}] {msg}"))
+        worker.finished_ok.connect(partial(self._on_generation_finished, task_id))
+        worker.error.connect(partial(self._on_generation_error, task_id))
+        worker.stream_ready.connect(partial(self._on_stream_ready, task_id))
+        worker.finished.connect(partial(self._on_worker_finished, task_id))
+        row.cancel_btn.clicked.connect(partial(self._cancel_task, task_id))
+        self.tasks[task_id] = {"worker": worker, "item": item, "row": row, "progress": 0, "prompt": prompt,
+                               "submitted_at": time.time()}
 
         # UI 状态更新
-        self.generate_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
-        self.progress_bar.setValue(0)
-        if hasattr(self, "status_label"):
-            self.status_label.setText("API: 请求中...")
+        self._update_overall_progress()
+        self.thread_pool.start(worker)
 
-        # 启动线程
-        self.worker = GenerationWorker(prompt, params)
-        self.worker.progress_changed.connect(self._on_progress_changed)
-        self.worker.log_message.connect(self._log)
-        self.worker.finished_ok.connect(self._on_generation_finished)
-        self.worker.error.connect(self._on_generation_error)
-        self.worker.finished.connect(self._on_worker_finished)
-        self.worker.start()
+    def _cancel_task(self, task_id: int):
+        task = self.tasks.get(task_id)
+        if not task:
+            return
+        if self.thread_pool.tryTake(task["worker"]):
+            # 还在本地排队，尚未发出任何请求
+            self._log(f"[#{task_id}] 已从本地队列移除")
+            self._on_generation_error(task_id, "用户取消")
+            self._on_worker_finished(task_id)
+            return
+        task["worker"].stop()
+        self._log(f"[#{task_id}] 正在取消任务，并通知服务端释放资源...")
 
     def _on_stop_clicked(self):
-        if self.worker:
-            self.worker.stop()
-            self._log("尝试中断请求（如果数据已在传输中可能无法立刻停止）...")
+        for task_id in list(self.tasks):
+            self._cancel_task(task_id)
 
     def _open_output_dir(self):
         dir_path = self.output_dir_edit.text().strip()
@@ -641,34 +1356,110 @@ class MainWindow(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "播放失败", str(e))
 
+    def _on_stream_ready(self, task_id: int, url: str):
+        """流式任务开始渲染：交给系统播放器边下边播，下载完成后不再询问是否播放。"""
+        self._log(f"[#{task_id}] 边渲染边播放: {url}")
+        if not QDesktopServices.openUrl(QUrl(url)):
+            self._log(f"[#{task_id}] 无法打开播放器，请等待下载完成后播放")
+            return
+        task = self.tasks.get(task_id)
+        if task:
+            task["streamed"] = True
+
     def _on_result_double_clicked(self, item: QListWidgetItem):
         path = item.data(Qt.UserRole)
         if path and os.path.isfile(path):
             self._play_video_in_widget(path)
-        else:
+        elif path:
             QMessageBox.warning(self, "错误", "文件不存在")
 
-    def _on_progress_changed(self, value: int):
-        self.progress_bar.setValue(value)
-
-    def _on_generation_finished(self, output_path: str, params: dict):
-        self._log(f"保存成功: {output_path}")
+    def _on_progress_changed(self, task_id: int, value: int):
+        task = self.tasks.get(task_id)
+        if not task:
+            return
+        if task["progress"] == 0 and value > 0:
+            task["row"].title_label.setText(f"#{task_id} 生成中: {task['prompt'][:30]}")
+        task["progress"] = value
+        task["row"].progress_bar.setValue(value)
+        self._update_overall_progress()
+
+    def _update_overall_progress(self):
+        """总进度条显示所有进行中任务的平均进度。"""
+        if self.tasks:
+            value = sum(task["progress"] for task in self.tasks.values()) // len(self.tasks)
+            self.progress_bar.setValue(value)
+            if hasattr(self, "status_label"):
+                self.status_label.setText(f"API: 请求中 ({len(self.tasks)})")
+
+    def _on_generation_finished(self, task_id: int, output_path: str, params: dict):
+        self._log(f"[#{task_id}] 保存成功: {output_path}")
         if hasattr(self, "status_label"):
             self.status_label.setText("API: 正常")
-        item_text = f"[{datetime.now().strftime('%H:%M:%S')}] {os.path.basename(output_path)}"
-        item = QListWidgetItem(item_text)
+        task = self.tasks[task_id]
+        if params.get("manifest"):
+            record = params["manifest"].record(task["prompt"], "ok", path=output_path,
+                                               latency=time.time() - task["submitted_at"])
+            params["batch"]["results"].append(record)
+        item = task["item"]
         item.setToolTip(output_path)
         item.setData(Qt.UserRole, output_path)
-        self.result_list.addItem(item)
-        self.result_list.scrollToBottom()
+        task["row"].set_finished(f"[{datetime.now().strftime('%H:%M:%S')}] {os.path.basename(output_path)}")
+
+        if params.get("preview"):
+            self._on_preview_finished(task["prompt"], output_path, params)
+            return
+
+        # 批量任务、已在边渲染边播放或还有其它任务在进行时不弹窗打扰，双击历史记录即可播放
+        if params.get("manifest") or task.get("streamed") or len(self.tasks) > 1:
+            return
+
+        if params.get("output_format", "mp4") != "mp4":
+            QMessageBox.information(self, "完成", f"关节数据已下载：\n{output_path}")
+            return
 
         reply = QMessageBox.question(self, "完成", "视频已下载，是否立即播放？", 
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
         if reply == QMessageBox.Yes:
             self._play_video_in_widget(output_path)
 
-    def _on_generation_error(self, message: str):
-        self._log(f"错误: {message}")
+    def _on_preview_finished(self, prompt: str, output_path: str, params: dict):
+        """预览完成：把预览所用的 seed 填入界面，并询问是否用同一 seed 生成完整质量版本。"""
+        seed = params.get("seed")
+        if seed is None:
+            return
+        self.random_seed_checkbox.setChecked(False)
+        self.seed_spin.setValue(seed)
+        self._log(f"预览种子 {seed} 已填入，点击“开始生成”即可得到完整质量版本")
+        if len(self.tasks) > 1:
+            return
+        if params.get("output_format", "mp4") == "mp4":
+            self._play_video_in_widget(output_path)
+        reply = QMessageBox.question(self, "预览完成", f"是否用同一种子 ({seed}) 生成完整质量版本？",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self._submit_task(prompt, dict(params, preview=False))
+
+    def _on_generation_error(self, task_id: int, message: str):
+        self._log(f"[#{task_id}] 错误: {message}")
+        task = self.tasks.get(task_id)
+        manifest = task["worker"].params.get("manifest") if task else None
+        if message == "用户取消":
+            if task:
+                task["row"].set_failed(f"#{task_id} 已取消")
+            if manifest:
+                # 取消的 prompt 未完成，下次导入会重新生成
+                record = manifest.record(task["prompt"], "cancelled",
+                                         latency=time.time() - task["submitted_at"])
+                task["worker"].params["batch"]["results"].append(record)
+            return
+        if task:
+            task["row"].set_failed(f"#{task_id} 失败: {message[:40]}")
+            if manifest:
+                # 批量任务失败只记录，不逐条弹窗
+                record = manifest.record(task["prompt"], "failed", latency=time.time() - task["submitted_at"],
+                                         error=message)
+                task["worker"].params["batch"]["results"].append(record)
+                return
         if hasattr(self, "status_label"):
             self.status_label.setText("API: 错误")
         QMessageBox.critical(self, "生成失败", message)
@@ -676,10 +1467,27 @@ class MainWindow(QMainWindow):
             # 如果不是错误状态，则标记为空闲/待命
             self.status_label.setText("API: 待命")
 
-    def _on_worker_finished(self):
-        self.generate_btn.setEnabled(True)
-        self.stop_btn.setEnabled(False)
-        self.worker = None
+    def _on_worker_finished(self, task_id: int):
+        task = self.tasks.pop(task_id, None)
+        if not self.tasks:
+            self.stop_btn.setEnabled(False)
+        self._update_overall_progress()
+        batch = task["worker"].params.get("batch") if task else None
+        if batch:
+            batch["remaining"] -= 1
+            if batch["remaining"] == 0:
+                self._finish_batch(batch)
+
+    def _finish_batch(self, batch: dict):
+        """导入的一批任务全部结束：写出 summary.json。"""
+        try:
+            summary = write_batch_summary(batch["output_dir"], batch["total"], batch["unique"], batch["skipped"],
+                                          batch["results"], time.time() - batch["started_at"])
+        except OSError as e:
+            self._log(f">>> 写入 summary.json 失败: {e}")
+            return
+        self._log(f">>> 批量生成结束：成功 {summary['succeeded']}，失败 {summary['failed']}，"
+                  f"跳过 {summary['skipped']}，汇总见 {os.path.join(batch['output_dir'], 'summary.json')}")
 
     def _log(self, message: str):
         timestamp = datetime.now().strftime("[%H:%M:%S]")
@@ -728,7 +1536,27 @@ def apply_dark_tech_theme(app: QApplication):
 
 
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="智创帧生客户端；指定 --batch 时以无界面模式批量生成")
+    parser.add_argument("--batch", metavar="FILE", help="批量 prompt 文件 (.txt / .csv / .jsonl)")
+    parser.add_argument("--output-dir", default=os.path.join(os.getcwd(), "downloaded_videos"))
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENT_JOBS,
+                        help=f"同时进行的任务数（1~{MAX_CONCURRENT_JOBS}）")
+    parser.add_argument("--format", default="mp4", choices=sorted(OUTPUT_FORMAT_EXT))
+    parser.add_argument("--no-translate", action="store_true", help="不在服务端翻译 prompt")
+    parser.add_argument("--renderer", default="matplotlib", choices=("matplotlib", "native"),
+                        help="mp4 渲染器，native 为快速渲染")
+    parser.add_argument("--num-frames", type=int, default=None, help="生成帧数，默认使用服务端的 210 帧")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，指定后结果可复现")
+    args, qt_args = parser.parse_known_args()
+
+    if args.batch:
+        summary = run_batch(load_prompt_file(args.batch), args.output_dir,
+                            concurrency=args.concurrency, output_format=args.format,
+                            translate=not args.no_translate, renderer=args.renderer,
+                            num_frames=args.num_frames, seed=args.seed)
+        sys.exit(0 if summary["failed"] == 0 else 1)
+
+    app = QApplication(sys.argv[:1] + qt_args)
     apply_dark_tech_theme(app)
     window = MainWindow()
     window.show()